@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# alerts.py - Alert rules evaluated over the collected data of each host
+#
+#    Copyright (C) 2020 Jonathan Drake (drakej) <952345+drakej@users.noreply.github.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+# Each rule looks at the inputs of one host, the parts of the snapshot that
+# concern it, and returns the conditions it finds, as (key, severity,
+# message), plus when to look again if the answer depends on time alone.
+# The engine keeps the alerts that are active on each host: a condition
+# that appears raises an alert, one that goes away resolves it, and one that
+# persists doesn't notify anything again. Raised and resolved alerts are
+# sent to the sinks, each one deciding what to do with them.
+#
+# Snapshots replace the data of the hosts they polled only, so a host whose
+# inputs are the very same objects as last time didn't change and its rules
+# aren't run again, unless a time they asked for is reached.
+
+import json
+import logging
+import queue
+import threading
+import time
+import urllib.request
+from collections import deque
+from datetime import timedelta
+
+import client
+
+LOGGER = logging.getLogger('boinc-cluster')
+
+# Task state of the rows of the tasks that failed
+ERROR_STATE = "Computation error"
+
+SEVERITIES = ('warning', 'critical')
+
+# Thresholds of the rules, see the [alerts] section of config.template.ini
+SETTINGS = {
+    'offline_after': 600,
+    'error_rate': 0.25,
+    'error_min_tasks': 3,
+    'disk_min_available': 1024 ** 3,
+    'deadline_min_tasks': 1,
+    'network_suspended': True
+}
+
+
+def offline(inputs, now, settings):
+    since = inputs.get('unreachableSince')
+    if since is None:
+        return [], None
+
+    due = since + settings['offline_after']
+    if now < due:
+        return [], due
+    return [('', 'critical', "unreachable for "
+             f"{timedelta(seconds=int(now - since))}")], None
+
+
+def errors(inputs, now, settings):
+    rows = inputs.get('tasks') or {}
+    failed = sum(1 for row in rows.values() if row['state'] == ERROR_STATE)
+    if (not failed or failed < settings['error_min_tasks']
+            or failed / len(rows) < settings['error_rate']):
+        return [], None
+    return [('', 'warning',
+             f"{failed} of {len(rows)} tasks ended in a computation error")], \
+        None
+
+
+def disk(inputs, now, settings):
+    usage = inputs.get('disk')
+    if usage is None or usage['available'] >= settings['disk_min_available']:
+        return [], None
+    return [('', 'critical' if usage['available'] <= 0 else 'warning',
+             f"{max(usage['available'], 0) / 1024 ** 2:.0f} MB of disk "
+             "left for BOINC")], None
+
+
+def deadlines(inputs, now, settings):
+    risks = inputs.get('risks') or ()
+    late = sum(1 for risk in risks if risk['late'])
+    atRisk = sum(1 for risk in risks if risk['atRisk'])
+    if atRisk < settings['deadline_min_tasks']:
+        return [], None
+    return [('', 'critical' if late else 'warning',
+             f"{atRisk} tasks at risk of missing their deadline, "
+             f"{late} projected late")], None
+
+
+def network(inputs, now, settings):
+    status = inputs.get('status')
+    if (not settings['network_suspended'] or status is None
+            or not status.network_suspend_reason):
+        return [], None
+    return [('', 'warning', "network suspended: "
+             f"{client.SuspendReason.name(status.network_suspend_reason)}")], \
+        None
+
+
+# Rules by name, as rule(inputs, now, settings) returning (list of (key,
+# severity, message), time to evaluate again or None)
+RULES = {
+    'offline': offline,
+    'errors': errors,
+    'disk': disk,
+    'deadlines': deadlines,
+    'network': network
+}
+
+
+class AlertEngine(object):
+    ''' Active alerts of every host, kept up to date by update() '''
+
+    def __init__(self, rules=RULES, sinks=(), settings=SETTINGS):
+        self.rules = rules
+        self.sinks = list(sinks)
+        self.settings = dict(SETTINGS, **settings)
+        # active alerts by (rule, key), by host
+        self.active = {}
+        # inputs last evaluated, by host
+        self.inputs = {}
+        # time to evaluate each host again regardless of its inputs
+        self.timers = {}
+        # ids of the events, in order
+        self.sequence = int(time.time() * 1000)
+        self.lock = threading.Lock()
+
+    def restore(self, alerts):
+        ''' Take the active alerts of a previous run, so conditions that
+            still hold aren't raised again
+        '''
+        with self.lock:
+            for alert in alerts:
+                self.active.setdefault(alert['host'], {})[
+                    (alert['rule'], alert['key'])] = dict(alert)
+
+    def update(self, inputsByHost, now=None):
+        ''' Evaluate the rules of the hosts of the {host: inputs} dict whose
+            inputs aren't the same objects as last time, or that are due
+            again, and resolve the alerts of hosts that are gone. Return the
+            list of the events sent to the sinks.
+        '''
+        now = time.time() if now is None else now
+        events = []
+
+        with self.lock:
+            for host in [host for host in self.active.keys() | self.inputs
+                         if host not in inputsByHost]:
+                events.extend(self.evaluate(host, None, now))
+
+            for host, inputs in inputsByHost.items():
+                previous = self.inputs.get(host)
+                if (previous is not None and previous.keys() == inputs.keys()
+                        and all(previous[name] is inputs[name]
+                                for name in inputs)
+                        and self.timers.get(host, now + 1) > now):
+                    continue
+                events.extend(self.evaluate(host, inputs, now))
+
+        for event in events:
+            for sink in self.sinks:
+                try:
+                    sink.notify(event)
+                except Exception:
+                    LOGGER.exception(f"Alert sink {sink} failed")
+
+        return events
+
+    def evaluate(self, host, inputs, now):
+        ''' Run the rules of host, None for a host that's gone, and return
+            the events of the alerts raised and resolved
+        '''
+        found = {}
+        self.timers.pop(host, None)
+        if inputs is None:
+            self.inputs.pop(host, None)
+        else:
+            self.inputs[host] = inputs
+            for name, rule in self.rules.items():
+                conditions, recheck = rule(inputs, now, self.settings)
+                if recheck is not None:
+                    self.timers[host] = min(self.timers.get(host, recheck),
+                                            recheck)
+                for key, severity, message in conditions:
+                    found[(name, key)] = (severity, message)
+
+        active = self.active.get(host, {})
+        events = []
+        for ident in [ident for ident in active if ident not in found]:
+            events.append(self.event('resolved', active.pop(ident), now))
+
+        for ident, (severity, message) in found.items():
+            alert = active.get(ident)
+            if alert is None:
+                alert = active[ident] = {
+                    'host': host, 'rule': ident[0], 'key': ident[1],
+                    'since': now}
+                alert.update(severity=severity, message=message)
+                events.append(self.event('raised', alert, now))
+            elif (alert['severity'], alert['message']) != (severity, message):
+                # the same condition, worse or better: no new notification
+                active[ident] = dict(alert, severity=severity,
+                                     message=message)
+
+        if active:
+            self.active[host] = active
+        else:
+            self.active.pop(host, None)
+        return events
+
+    def event(self, state, alert, now):
+        self.sequence += 1
+        return dict(alert, id=self.sequence, state=state, time=now)
+
+    def alerts(self):
+        ''' Return the list of the active alerts, most severe first '''
+        with self.lock:
+            alerts = [dict(alert) for active in self.active.values()
+                      for alert in active.values()]
+        return sorted(alerts, key=lambda alert: (
+            -SEVERITIES.index(alert['severity']), alert['host'],
+            alert['rule'], alert['key']))
+
+
+class LogSink(object):
+    ''' Logs raised alerts as warnings and resolved ones as information '''
+
+    def notify(self, event):
+        level = logging.WARNING if event['state'] == 'raised' else logging.INFO
+        LOGGER.log(level, f"Alert {event['state']} on {event['host']}: "
+                   f"{event['rule']} - {event['message']}")
+
+
+class WebhookSink(object):
+    ''' POSTs each event as JSON to url, from a thread of its own so a slow
+        or unreachable receiver doesn't hold up the collection cycles
+    '''
+
+    def __init__(self, url, timeout=5, backlog=1000):
+        self.url = url
+        self.timeout = timeout
+        self.queue = queue.Queue(backlog)
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def __repr__(self):
+        return f"WebhookSink({self.url!r})"
+
+    def notify(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            LOGGER.error(f"Dropped alert {event['id']}, {self.url} is behind")
+
+    def run(self):
+        while True:
+            event = self.queue.get()
+            request = urllib.request.Request(
+                self.url, data=json.dumps(event).encode(),
+                headers={'Content-Type': 'application/json'})
+            try:
+                urllib.request.urlopen(request, timeout=self.timeout).close()
+            except OSError as error:
+                LOGGER.error(f"Couldn't post alert {event['id']} to "
+                             f"{self.url}: {error}")
+
+
+class StreamSink(object):
+    ''' Keeps the last limit events, for the server-sent events of the
+        dashboard
+    '''
+
+    def __init__(self, limit=200):
+        self.events = deque(maxlen=limit)
+
+    def notify(self, event):
+        self.events.append(event)
+
+    def recent(self):
+        return tuple(self.events)
+
+
+def stream(events, after):
+    ''' Return the server-sent event messages of the events with an id over
+        after
+    '''
+    return ''.join(f"id: {event['id']}\nevent: {event['state']}\n"
+                   f"data: {json.dumps(event)}\n\n"
+                   for event in events if event['id'] > after)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# balance.py - Work queue balancing recommendations for the cluster
+#
+#    Copyright (C) 2020 Jonathan Drake (drakej) <952345+drakej@users.noreply.github.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+# The queue of a host is the estimated time left of its unfinished tasks,
+# divided by the processors that run them: CPU tasks over its CPUs, GPU
+# tasks over its GPUs. A host whose queue is under the low mark is starved,
+# one over the high mark overloaded. Projects that don't get new tasks on a
+# starved host should be allowed more work, and those that still get tasks
+# on an overloaded host should stop. Everything comes from the collected
+# data, no RPC is made until a recommendation is applied with project_op.
+
+from collections import OrderedDict
+
+# Queue bounds, in seconds of work per processor
+QUEUE_LOW = 6 * 3600
+QUEUE_HIGH = 3 * 86400
+
+# Words of Result.resources naming a GPU, e.g. "0.2 CPUs + 1 NVIDIA GPU"
+GPU_WORDS = ('GPU', 'NVIDIA', 'AMD', 'ATI', 'intel_gpu')
+
+
+def uses_gpu(resources):
+    return bool(resources) and any(word in resources for word in GPU_WORDS)
+
+
+def host_queue(rows, hostModel, ncpus, ngpus):
+    ''' Return the (CPU, GPU) queues of a host in seconds per processor,
+        None for processors it doesn't have, from its {name: row} task rows
+        and its model.HostModel, if known, for the resources of each task
+    '''
+    cpu = gpu = 0.0
+    for name, row in rows.items():
+        if row['percent'] >= 100:
+            continue
+        result = hostModel.lookup_result(name) if hostModel else None
+        if result is not None and uses_gpu(result.resources):
+            gpu += row['remainingSeconds']
+        else:
+            cpu += row['remainingSeconds']
+
+    return (cpu / ncpus if ncpus else None,
+            gpu / ngpus if ngpus else None)
+
+
+def recommend(hostMap, taskRowsByHostMap, hostModelMap, projects,
+              low=QUEUE_LOW, high=QUEUE_HIGH):
+    ''' Return ({host: summary}, list of recommendations) for the hosts of
+        hostMap. A summary holds the CPU and GPU queues, processor counts and
+        status ('starved', 'overloaded' or 'ok'). A recommendation is a
+        dict of the host, project URL and name, project_op operation and
+        reason.
+    '''
+    projectsByHost = {}
+    for project in projects:
+        projectsByHost.setdefault(project.hostname, []).append(project)
+
+    hosts = OrderedDict()
+    actions = []
+    for host, info in hostMap.items():
+        ncpus = info.get('ncpus') or 0
+        ngpus = info.get('ngpus') or 0
+        cpu, gpu = host_queue(taskRowsByHostMap.get(host, {}),
+                              hostModelMap.get(host), ncpus, ngpus)
+
+        queues = [queue for queue in (cpu, gpu) if queue is not None]
+        if queues and min(queues) < low:
+            status = 'starved'
+        elif queues and max(queues) > high:
+            status = 'overloaded'
+        else:
+            status = 'ok'
+
+        hosts[host] = {'cpuQueue': cpu, 'gpuQueue': gpu, 'ncpus': ncpus,
+                       'ngpus': ngpus, 'status': status}
+
+        for project in projectsByHost.get(host, ()):
+            if project.ended or project.detach_when_done:
+                continue
+
+            if status == 'starved' and project.dont_request_more_work:
+                op = 'allowmorework'
+                reason = f"queue under {low // 3600} h per processor"
+            elif status == 'overloaded' and not project.dont_request_more_work:
+                op = 'nomorework'
+                reason = f"queue over {high // 3600} h per processor"
+            else:
+                continue
+
+            actions.append({'host': host, 'project': project.master_url,
+                            'projectName': project.project_name, 'op': op,
+                            'reason': reason})
+
+    return hosts, actions
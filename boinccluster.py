@@ -1,30 +1,84 @@
 #!/usr/bin/python3
 
-from ctypes import sizeof
+import copy
 import json
 import socket
+import sqlite3
+import threading
+import zlib
 from collections import OrderedDict
 import time
-from flask import Flask, render_template, request
 from datetime import datetime, timedelta
 import client
 import configparser
+from symbols import SymbolTable
+import snapshot
+import compression
+import store
+import history
+import cadence
+import model
+import taskindex
+import search
+import deadlines
+import balance
+import diskusage
+import xfers
+import eventlog
+import alerts
 
 import logging
-from flask.logging import default_handler
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 # Flask's magic create_app pattern
 LOGGER = logging.getLogger('boinc-cluster')
 
-LOGGER.addHandler(default_handler)
 LOGGER.setLevel(logging.INFO)
 
 
 def create_app(test_config=None):
+    global SUBSCRIBER
+
+    # Flask is only imported here, the collector and scripts using the
+    # update functions don't need it
+    from flask import (Flask, Response, abort, g, render_template, request,
+                       stream_with_context)
+    from flask.logging import default_handler
+
+    LOGGER.addHandler(default_handler)
+
     app = Flask(__name__)
 
     # updateState()
 
+    if config.has_option('collector', 'address') and not SUBSCRIBER:
+        import collector
+        SUBSCRIBER = collector.Subscriber(collector.address(config),
+                                          collector.authkey(config),
+                                          snapshot.install)
+        SUBSCRIBER.start()
+    elif restoreSnapshot():
+        threading.Thread(target=warmUp, daemon=True).start()
+
+    @app.template_filter('formatduration')
+    def format_duration(seconds):
+        seconds = int(seconds or 0)
+        return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60,
+                                 seconds % 60)
+
+    @app.template_filter('formattimestamp')
+    def format_timestamp(timestamp):
+        return datetime.fromtimestamp(timestamp).strftime('%a %d %b %Y %H:%M')
+
     @app.template_filter('formatbytes')
     def format_bytes(size):
         tera = 1024*1024*1024*1024
@@ -51,38 +105,123 @@ def create_app(test_config=None):
 
         return "%0.2f %s" % (val, unit)
 
+    def cachedResponse(snap, names, render, variant=None):
+        ''' Return the response of render() for the versions of the named
+            datasets in snap, with its ETag and Last-Modified headers. It is
+            rendered once per version and reused until the next one, and
+            conditional requests for an unchanged version get a 304.
+        '''
+        datasets = g.datasets = [snap.datasets[name] for name in names]
+        etag = snapshot.etag(datasets)
+        if variant is not None:
+            etag += '-%x' % zlib.crc32(repr(variant).encode())
+        key = (request.endpoint, variant)
+
+        with RENDER_CACHE_LOCK:
+            cached = renderCache.get(key)
+            if cached:
+                renderCache.move_to_end(key)
+        if cached and cached[0] == etag:
+            response = Response(cached[1], mimetype=cached[2])
+        else:
+            response = app.make_response(render())
+            cached = (etag, response.get_data(), response.mimetype, {})
+            with RENDER_CACHE_LOCK:
+                renderCache[key] = cached
+                renderCache.move_to_end(key)
+                while len(renderCache) > RENDER_CACHE_SIZE:
+                    renderCache.popitem(last=False)
+
+        encoding = compression.choose_encoding(request.accept_encodings)
+        response.vary.add('Accept-Encoding')
+        if (encoding and len(cached[1]) >= COMPRESS_MIN_SIZE
+                and compression.compressible(cached[2])):
+            if encoding not in cached[3]:
+                cached[3][encoding] = compression.compress(cached[1], encoding)
+            response.set_data(cached[3][encoding])
+            response.content_encoding = encoding
+            # a distinct representation needs a distinct entity tag
+            etag += '-' + encoding
+
+        response.set_etag(etag)
+        response.last_modified = datetime.utcfromtimestamp(
+            snapshot.modified(datasets))
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    @app.context_processor
+    def restoredAt():
+        ''' Time of the oldest data restored from disk among the datasets
+            of the page being rendered, for the banner of base.html
+        '''
+        restored = [dataset.modified for dataset in g.get('datasets', ())
+                    if dataset.restored]
+        return {'restored_at': datetime.fromtimestamp(min(restored))
+                if restored else None}
+
+    @app.after_request
+    def compressResponse(response):
+        ''' Compress responses that didn't go through cachedResponse(),
+            streamed ones on the fly
+        '''
+        if (response.status_code != 200 or response.content_encoding
+                or response.direct_passthrough
+                or not compression.compressible(response.mimetype)):
+            return response
+
+        encoding = compression.choose_encoding(request.accept_encodings)
+        response.vary.add('Accept-Encoding')
+        if not encoding:
+            return response
+
+        if response.is_streamed:
+            response.response = compression.compress_stream(
+                response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        elif response.content_length >= COMPRESS_MIN_SIZE:
+            response.set_data(compression.compress(
+                response.get_data(), encoding))
+        else:
+            return response
+
+        response.content_encoding = encoding
+        return response
+
     @app.route('/')
     def index():
-        updateStatus()
+        refresh(['status', 'projects', 'tasks'])
+        snap = snapshot.current()
 
-        updateProjects()
-        updateTasks()
-        total_unique_projects = 0
-        unique_projects = {}
+        def render():
+            total_unique_projects = 0
+            unique_projects = {}
 
-        task_totals_by_status = {}
+            task_totals_by_status = {}
 
-        for task in TASKS:
-            if task['state'] not in task_totals_by_status:
-                task_totals_by_status[task['state']] = 1
-            else:
-                task_totals_by_status[task['state']] += 1
+            for task in snap.tasks:
+                if task['state'] not in task_totals_by_status:
+                    task_totals_by_status[task['state']] = 1
+                else:
+                    task_totals_by_status[task['state']] += 1
 
-        for project in PROJECTS:
-            if project.project_name not in unique_projects:
-                unique_projects[project.project_name] = True
-                total_unique_projects += 1
-        return render_template('./index.html', status=STATUS, tasks=TASKS, projects=PROJECTS, total_unique_projects=total_unique_projects, task_totals_by_status=task_totals_by_status)
+            for project in snap.projects:
+                if project.project_name not in unique_projects:
+                    unique_projects[project.project_name] = True
+                    total_unique_projects += 1
+            return render_template('./index.html', status=snap.status, tasks=snap.tasks, projects=snap.projects, total_unique_projects=total_unique_projects, task_totals_by_status=task_totals_by_status)
+
+        return cachedResponse(snap, ['status', 'projects', 'tasks'], render)
 
     @app.route('/statistics')
     def statistics():
-        updateProjects()
-        updateStatistics()
-        return render_template('./statistics.html', statistics=statsMap)
+        refresh(['projects', 'statistics'])
+        snap = snapshot.current()
+        return cachedResponse(snap, ['projects', 'statistics'], lambda: render_template(
+            './statistics.html', statistics=snap.statsMap))
 
     @app.route('/computers', methods=['POST', 'GET'])
     def computers():
-        updateHosts()
+        refresh(['hosts'])
         if request.method == 'POST':
             hosts = request.form.getlist('host')
             run_modes = request.form.getlist('rmode')
@@ -92,70 +231,340 @@ def create_app(test_config=None):
             for host in hosts:
                 h_index = hosts.index(host)
 
-                if host in hostConnectionsMap:
-                    boinc_client = hostConnectionsMap[host]
-                else:
-                    boinc_client = client.BoincClient(
-                        host=host, passwd=config['hosts'][host])
+                if host not in config['hosts']:
+                    continue
 
-                    hostConnectionsMap[host] = boinc_client
-
-                    try:
-                        boinc_client.connect()
-                    except (socket.timeout, OSError) as timeout:
-                        LOGGER.info(f"Timeout: {timeout}")
-
-                srm_result = boinc_client.set_run_mode(
-                    int(run_modes[h_index]))
-                sgm_result = boinc_client.set_gpu_mode(
-                    int(gpu_modes[h_index]))
-                snm_result = boinc_client.set_network_mode(
-                    int(network_modes[h_index]))
-
-                LOGGER.info(f"set_run_mode on {host} result: {srm_result}")
-                LOGGER.info(f"set_gpu_mode on {host} result: {sgm_result}")
-                LOGGER.info(
-                    f"set_network_mode on {host} result: {snm_result}")
+                hostCommand(host, 'set_run_mode', int(run_modes[h_index]))
+                hostCommand(host, 'set_gpu_mode', int(gpu_modes[h_index]))
+                hostCommand(host, 'set_network_mode',
+                            int(network_modes[h_index]))
 
             # Ensure we update again since the state changed
-            updateHosts()
+            refresh(['hosts', 'status'], force=True)
 
-        updateStatus()
-        updateTasks()
+        refresh(['status', 'tasks'])
+        snap = snapshot.current()
 
-        return render_template('./computers.html', hosts=hostMap,
-                               status=STATUS,
-                               runModes=runModeDescMap,
-                               gpuModes=gpuModeDescMap,
-                               netModes=netModeDescMap,
-                               tasksByHosts=tasksByHostMap)
+        return cachedResponse(snap, ['hosts', 'status', 'tasks'], lambda: render_template(
+            './computers.html', hosts=snap.hostMap,
+            status=snap.status,
+            runModes=runModeDescMap,
+            gpuModes=gpuModeDescMap,
+            netModes=netModeDescMap,
+            tasksByHosts=snap.tasksByHostMap))
 
     def projects():
         updateProjects(cache=False)
-        return render_template('./projects.html', projects=PROJECTS)
+        return render_template('./projects.html',
+                               projects=snapshot.current().projects)
 
     @app.route('/tasks')
     def tasks():
-        updateState()
-        updateTasks()
-        return render_template('./tasks.html', tasks=TASKS, hosts=config['hosts'])
+        refresh(['tasks'])
+        snap = snapshot.current()
+        # ?search= fills the search box of the table, for links. Searches
+        # are free text, they aren't worth a render cache entry each.
+        search = request.args.get('search', '')
+        if search:
+            return render_template('./tasks.html', tasks=snap.tasks,
+                                   hosts=config['hosts'], search=search)
+        return cachedResponse(snap, ['tasks'], lambda: render_template(
+            './tasks.html', tasks=snap.tasks, hosts=config['hosts'],
+            search=search))
+
+    @app.route('/deadlines')
+    def deadlineRisks():
+        ''' Tasks at risk of missing their deadline, most urgent first, and
+            the summary of each host, as JSON with ?format=json
+        '''
+        refresh(['tasks'])
+        snap = snapshot.current()
+        format = 'json' if request.args.get('format') == 'json' else 'html'
+
+        def render():
+            tasks, hosts = deadlines.ranked(snap.taskRisks)
+            if format == 'json':
+                return Response(json.dumps({'tasks': tasks, 'hosts': hosts}),
+                                mimetype='application/json')
+            return render_template('./deadlines.html', tasks=tasks,
+                                   hosts=hosts, margin=DEADLINES.margin)
+
+        return cachedResponse(snap, ['tasks'], render, format)
+
+    @app.route('/balance', methods=['POST', 'GET'])
+    def balanceQueues():
+        ''' Hosts with too little or too much queued work, and the
+            project_op operations that would even them out. POST host,
+            project and op to apply one.
+        '''
+        if request.method == 'POST':
+            host = request.form.get('host', '')
+            op = request.form.get('op', '')
+            project = request.form.get('project', '')
+            if host not in config['hosts'] or op not in PROJECT_OPS \
+                    or not project:
+                abort(400, "POST a configured host, a project and op, one "
+                      f"of {', '.join(PROJECT_OPS)}")
+
+            hostCommand(host, 'project_op', project, op)
+
+            refresh(['projects'], force=True)
+
+        refresh(['hosts', 'projects', 'state', 'tasks'])
+        snap = snapshot.current()
+        format = 'json' if request.args.get('format') == 'json' else 'html'
+
+        def render():
+            hosts, actions = balance.recommend(
+                snap.hostMap, snap.taskRowsByHostMap, snap.hostModelMap,
+                snap.projects, QUEUE_LOW, QUEUE_HIGH)
+            if format == 'json':
+                return Response(json.dumps({'hosts': hosts,
+                                            'actions': actions}),
+                                mimetype='application/json')
+            return render_template('./balance.html', hosts=hosts,
+                                   actions=actions, low=QUEUE_LOW,
+                                   high=QUEUE_HIGH)
+
+        return cachedResponse(snap, ['hosts', 'projects', 'state', 'tasks'],
+                              render, format)
+
+    @app.route('/messages')
+    def eventLog():
+        ''' The latest event log messages and notices of the cluster or of a
+            host, or, given q, project or pri, those of the whole log
+            matching them. JSON with ?format=json.
+        '''
+        refresh(['messages'])
+        snap = snapshot.current()
+
+        args = request.args
+        text = args.get('q', '').strip()
+        host = args.get('host', '')
+        filters = {'host': host, 'project': args.get('project', ''),
+                   'pri': args.get('pri', type=int)}
+        limit = max(1, min(args.get('limit', MESSAGES_LIMIT, type=int),
+                           MESSAGES_MAX_LIMIT))
+
+        if text or filters['project'] or filters['pri']:
+            messageCount, messages = EVENTS.messages(text, limit, **filters)
+            noticeCount, notices = EVENTS.notices(text, limit, host)
+        else:
+            messages = eventlog.latest(snap.messageMap, limit, 'time', host)
+            notices = eventlog.latest(snap.noticeMap, limit, 'create_time',
+                                      host)
+            messageCount, noticeCount = len(messages), len(notices)
+
+        if args.get('format') == 'json':
+            return Response(json.dumps({
+                'messages': {'count': messageCount, 'results': messages},
+                'notices': {'count': noticeCount, 'results': notices}}),
+                mimetype='application/json')
+        return render_template('./messages.html', messages=messages,
+                               notices=notices, messageCount=messageCount,
+                               noticeCount=noticeCount, filters=filters,
+                               text=text, hosts=config['hosts'],
+                               priorities=client.MsgPriority)
+
+    @app.route('/alerts')
+    def alertList():
+        ''' Active alerts of the cluster and the latest ones raised and
+            resolved, as JSON with ?format=json
+        '''
+        refresh(['status', 'disk', 'tasks', 'alerts'])
+        snap = snapshot.current()
+        format = 'json' if request.args.get('format') == 'json' else 'html'
+
+        def render():
+            events = list(reversed(snap.alertEvents))
+            if format == 'json':
+                return Response(json.dumps({'alerts': snap.alerts,
+                                            'events': events}),
+                                mimetype='application/json')
+            return render_template('./alerts.html', alerts=snap.alerts,
+                                   events=events)
+
+        return cachedResponse(snap, ['alerts'], render, format)
+
+    @app.route('/alerts/stream')
+    def alertStream():
+        ''' Server-sent events of the alerts raised and resolved after the
+            Last-Event-ID header, or the after argument
+        '''
+        after = request.headers.get('Last-Event-ID', type=int) or \
+            request.args.get('after', 0, type=int)
+
+        def events(after):
+            sent = None
+            idle = 0.0
+            while True:
+                refresh(['alerts'])
+                latest = snapshot.current().alertEvents
+                if latest is not sent and latest:
+                    message = alerts.stream(latest, after)
+                    sent, after = latest, max(after, latest[-1]['id'])
+                    if message:
+                        idle = 0.0
+                        yield message
+                if idle >= ALERT_STREAM_KEEPALIVE:
+                    idle = 0.0
+                    yield ': keep-alive\n\n'
+                time.sleep(1)
+                idle += 1
+
+        response = Response(stream_with_context(events(after)),
+                            mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    @app.route('/search')
+    def searchDocuments():
+        ''' Find tasks, work units and projects whose name or other text
+            contains q, optionally of a kind and with exact host, project,
+            app, plan_class and state values, as JSON
+        '''
+        refresh(['projects', 'state', 'tasks'])
+
+        attributes = {field: request.args.get(field)
+                      for field in ('kind',) + tuple(SEARCH_ATTRIBUTES)}
+        limit = max(1, min(request.args.get('limit', SEARCH_LIMIT, type=int),
+                           SEARCH_MAX_LIMIT))
+        count, documents = searchIndex().find(request.args.get('q', ''),
+                                              limit, **attributes)
+        return Response(json.dumps({'count': count, 'results': documents}),
+                        mimetype='application/json')
 
     @app.route('/transfers')
     def transfers():
-        updateTransfers()
-        return render_template('./transfers.html', transfers=transferMap)
+        refresh(['status', 'transfers'])
+        snap = snapshot.current()
+        return cachedResponse(snap, ['transfers'], lambda: render_template(
+            './transfers.html', transfers=snap.transferMap,
+            rates=snap.transferRates,
+            total=xfers.summarize(snap.transferRates.values())))
 
     @app.route('/disk')
     def disk():
-        updateProjects()
-        updateDiskUsage()
-        return render_template('./disk.html', disk_usage_summaries=diskUsageMap)
+        ''' Disk usage of each host; with ?format=json, its samples and
+            trend, and the usage of each project over the cluster
+        '''
+        refresh(['projects', 'disk'])
+        snap = snapshot.current()
+        format = 'json' if request.args.get('format') == 'json' else 'html'
+
+        def render():
+            if format == 'json':
+                return Response(json.dumps(diskUsageHistory(snap)),
+                                mimetype='application/json')
+            return render_template('./disk.html',
+                                   disk_usage_summaries=snap.diskUsageMap)
+
+        return cachedResponse(snap, ['projects', 'disk'], render, format)
 
     @app.route('/tasks/live')
     def tasksLive():
-        updateState()
-        updateTasks()
-        return json.dumps({"data": TASKS})
+        refresh(['tasks'])
+        snap = snapshot.current()
+
+        # one page of DataTables server-side processing, see tasks.html
+        if 'draw' in request.args:
+            return Response(json.dumps(tasksPage(snap, request.args)),
+                            mimetype='application/json')
+
+        symbols = bool(request.args.get('symbols', type=int))
+        mimetype = request.accept_mimetypes.best_match(TASK_MIMETYPES)
+
+        def render():
+            # ?symbols=1 replaces repeated strings with their symbol table
+            # ids, and ships the table along
+            if symbols:
+                table = snap.symbols
+                data = table.encode(snap.tasks, TASK_SYMBOL_FIELDS)
+                return json.dumps({"symbols": table.symbols, "data": data})
+
+            # Column arrays with ids into a symbol table and durations in
+            # seconds, for clients that ask for them. Plain JSON rows stay
+            # the default.
+            if mimetype in (COLUMNS_MIMETYPE, MSGPACK_MIMETYPE):
+                table = snap.symbols
+                tasks = snap.tasks
+                payload = {
+                    "count": len(tasks),
+                    "columns": table.encode_columns(tasks, TASK_COLUMNS,
+                                                    TASK_SYMBOL_FIELDS),
+                    "symbols": table.symbols
+                }
+                if mimetype == MSGPACK_MIMETYPE:
+                    body = msgpack.packb(payload)
+                elif orjson:
+                    body = orjson.dumps(payload)
+                else:
+                    body = json.dumps(payload, separators=(',', ':'))
+                return Response(body, mimetype=mimetype)
+
+            return json.dumps({"data": snap.tasks})
+
+        response = cachedResponse(snap, ['tasks'], render, (symbols, mimetype))
+        response.vary.add('Accept')
+        return response
+
+    @app.route('/analytics')
+    def analytics():
+        refresh(['projects', 'state', 'results'])
+        snap = snapshot.current()
+
+        group = request.args.get('by', 'project')
+        if group not in history.GROUPS:
+            group = 'project'
+        days = request.args.get('days', ANALYTICS_DAYS, type=int)
+        days = max(1, min(days, ANALYTICS_MAX_DAYS))
+
+        def label(key):
+            if group == 'project' and key in snap.projectMap:
+                return snap.projectMap[key].project_name
+            if group == 'app':
+                for hostModel in snap.hostModelMap.values():
+                    app = hostModel.lookup_app(key)
+                    if app is not None:
+                        return app.user_friendly_name
+            return key
+
+        def render():
+            since = time.time() - days * history.SECONDS_PER_DAY
+
+            # completed tasks per key and day, most recent day first
+            throughput = OrderedDict()
+            dates = set()
+            for day, key, count in HISTORY.throughput(group, since):
+                throughput.setdefault(label(key), {})[day] = count
+                dates.add(day)
+
+            runTimes = [(label(key), tasks, elapsed, cpu, errors)
+                        for key, tasks, elapsed, cpu, errors
+                        in HISTORY.run_times(group, since)]
+
+            return render_template('./analytics.html', group=group,
+                                   groups=history.GROUPS, days=days,
+                                   dates=sorted(dates, reverse=True),
+                                   throughput=throughput, runTimes=runTimes)
+
+        return cachedResponse(snap, ['projects', 'state', 'results'], render,
+                              (group, days))
+
+    @app.route('/export/tasks.ndjson')
+    def exportTasks():
+        ''' Every task of the cluster, one JSON object per line, fetched
+            from the hosts one at a time and streamed as each answers, or
+            taken from the collector's snapshot. ?old=1 adds the old
+            results.
+        '''
+        old = request.args.get('old', type=int)
+        response = Response(stream_with_context(exportRecords(old)),
+                            mimetype='application/x-ndjson')
+        response.headers['Content-Disposition'] = \
+            'attachment; filename=tasks.ndjson'
+        return response
 
     return app
 
@@ -164,20 +573,272 @@ config = configparser.ConfigParser()
 
 config.read('config.ini')
 
-hostMap = OrderedDict()
-projectMap = OrderedDict()
-statsMap = OrderedDict()
-diskUsageMap = OrderedDict()
-transferMap = OrderedDict()
-appMap = {}
-appVersionMap = {}
-workUnitMap = {}
+# BoincClient settings of config.ini
+CLIENT_OPTIONS = client.client_options(config)
+
+# BoincClient of each host, shared by the threads refreshing datasets
 hostConnectionsMap = {}
-tasksByHostMap = {}
+CONNECTIONS_LOCK = threading.Lock()
+
+# Task row fields holding strings of the snapshot's symbol table
+TASK_SYMBOL_FIELDS = ('hostname', 'projectName', 'projectURL',
+                      'application', 'status', 'state')
+
+# Columnar /tasks/live format, see templates/tasks.html for the decoder
+COLUMNS_MIMETYPE = 'application/vnd.boinc-cluster.columns+json'
+MSGPACK_MIMETYPE = 'application/vnd.boinc-cluster.columns+msgpack'
+TASK_MIMETYPES = ['application/json', COLUMNS_MIMETYPE]
+if msgpack:
+    TASK_MIMETYPES.append(MSGPACK_MIMETYPE)
+TASK_COLUMNS = ('hostname', 'projectName', 'percent', 'status', 'state',
+                'elapsedSeconds', 'remainingSeconds', 'deadline',
+                'application', 'name')
+
+# Seconds during which collected data is served as is. Requests within it
+# reuse the current version of each dataset, and its cached responses.
+REFRESH_INTERVAL = config.getint(
+    'application', 'refresh_interval', fallback=10)
+
+DATASET_NAMES = ('status', 'projects', 'state', 'hosts', 'tasks',
+                 'statistics', 'disk', 'transfers', 'results', 'messages',
+                 'alerts')
+
+# Old results are kept by the core clients for an hour, polling them every
+# few minutes is enough
+RESULTS_REFRESH_INTERVAL = config.getint(
+    'application', 'results_refresh_interval', fallback=300)
+
+# New event log messages and notices are fetched on their own, slower
+# interval too
+MESSAGES_REFRESH_INTERVAL = config.getint(
+    'application', 'messages_refresh_interval', fallback=30)
+
+# Datasets refreshed on their own interval instead of REFRESH_INTERVAL
+DATASET_INTERVALS = {'results': RESULTS_REFRESH_INTERVAL,
+                     'messages': MESSAGES_REFRESH_INTERVAL}
+
+# RPC calls whose replies make up each dataset, as in BoincClient.batch()
+DATASET_CALLS = {
+    'status': ['get_cc_status'],
+    'projects': ['get_project_status'],
+    'state': ['get_state'],
+    'hosts': ['get_host_info'],
+    'tasks': ['get_simple_gui_info', ('get_results', False), 'get_cc_status'],
+    'statistics': ['get_statistics'],
+    'disk': ['get_disk_usage'],
+    'transfers': ['get_file_transfers'],
+    'results': ['get_old_results'],
+    'messages': ['get_message_count']
+}
 
-PROJECTS = []
-TASKS = []
-STATUS = OrderedDict()
+# Bounds of the polling interval of each (host, dataset), which adapts to how
+# often its replies change, see cadence.py. The datasets themselves are
+# still refreshed every REFRESH_INTERVAL, polling the hosts that are due.
+POLL_MIN_INTERVAL = config.getint(
+    'application', 'poll_min_interval', fallback=REFRESH_INTERVAL)
+POLL_MAX_INTERVAL = config.getint(
+    'application', 'poll_max_interval', fallback=300)
+SCHEDULE = cadence.Schedule(POLL_MIN_INTERVAL, POLL_MAX_INTERVAL)
+
+# Only apply what changed in each host's state since its previous poll to
+# its model.HostModel, rather than indexing all of it every time
+INCREMENTAL_STATE = config.getboolean(
+    'application', 'incremental_state', fallback=True)
+
+# Held while refreshing a dataset, so concurrent requests for the same stale
+# dataset poll the hosts once and the others wait for its new version
+UPDATE_LOCKS = {name: threading.Lock() for name in DATASET_NAMES}
+
+# The collected data, see snapshot.Snapshot. tasks holds the task rows, the
+# ones of each host also being in taskRowsByHostMap by task name. symbols
+# holds their repeated strings; it's only appended to between full task
+# refreshes, which start a new one so symbols of tasks that are gone don't
+# pile up. hostModelMap holds the model.HostModel of each host, taskRisks
+# the deadlines.DeadlineEngine assessment of the task rows of each host,
+# diskSamplesMap the diskusage.py samples of each host, transferRates the
+# xfers.TransferMonitor summary of the transfers of each host. messageMap
+# and noticeMap hold the eventlog.py records of the latest messages and
+# notices of each host. alerts holds the active alerts of ALERTS, and
+# alertEvents the latest ones raised and resolved.
+snapshot.install(snapshot.Snapshot(
+    {name: snapshot.Dataset(name, DATASET_INTERVALS.get(name, REFRESH_INTERVAL))
+     for name in DATASET_NAMES},
+    hostMap=OrderedDict(),
+    projectMap=OrderedDict(),
+    statsMap=OrderedDict(),
+    diskUsageMap=OrderedDict(),
+    diskSamplesMap={},
+    transferMap=OrderedDict(),
+    transferRates={},
+    messageMap={},
+    noticeMap={},
+    alerts=(),
+    alertEvents=(),
+    hostModelMap={},
+    tasksByHostMap={},
+    taskRowsByHostMap={},
+    taskRisks={},
+    projects=(),
+    tasks=(),
+    status=OrderedDict(),
+    symbols=SymbolTable()))
+
+# Snapshot fields of each dataset, as saved to SNAPSHOT_FILE
+DATASET_FIELDS = {
+    'status': ('status',),
+    'projects': ('projects', 'projectMap'),
+    'state': ('hostModelMap',),
+    'hosts': ('hostMap',),
+    'tasks': ('tasks', 'taskRowsByHostMap', 'tasksByHostMap', 'symbols',
+              'taskRisks'),
+    'statistics': ('statsMap',),
+    'disk': ('diskUsageMap', 'diskSamplesMap'),
+    'transfers': ('transferMap', 'transferRates'),
+    'messages': ('messageMap', 'noticeMap'),
+    'alerts': ('alerts', 'alertEvents')
+}
+
+# SQLite file the snapshot is saved to every SNAPSHOT_SAVE_INTERVAL seconds
+# and restored from at startup, empty to disable
+SNAPSHOT_FILE = config.get('application', 'snapshot_file',
+                           fallback='snapshot.db')
+SNAPSHOT_SAVE_INTERVAL = config.getint(
+    'application', 'snapshot_save_interval', fallback=60)
+SNAPSHOT_STORE = None
+# Set once warmUp() went through every dataset, restored or not
+WARMED_UP = threading.Event()
+
+# Completed tasks of every host, fed by updateResults(). The results dataset
+# is only its version, the data stays in RESULTS_FILE.
+RESULTS_FILE = config.get('application', 'results_file', fallback='results.db')
+HISTORY = history.ResultHistory(RESULTS_FILE)
+
+# Event log messages and notices of every host, fed by updateMessages(), and
+# how many of the latest ones of each host the snapshot keeps
+EVENTS_FILE = config.get('application', 'events_file', fallback='events.db')
+EVENTS = eventlog.EventLog(EVENTS_FILE)
+MESSAGE_RING_SIZE = config.getint(
+    'application', 'message_ring_size', fallback=eventlog.RING_SIZE)
+
+# Messages and notices shown by /messages by default, and at most
+MESSAGES_LIMIT = 100
+MESSAGES_MAX_LIMIT = 1000
+
+# Alert rules thresholds, and where raised and resolved alerts go: the log,
+# the latest ALERT_EVENTS of them for /alerts/stream, and the alerts webhook
+# URL if set
+ALERT_SETTINGS = {
+    'offline_after': config.getint('alerts', 'offline_after',
+                                   fallback=alerts.SETTINGS['offline_after']),
+    'error_rate': config.getfloat('alerts', 'error_rate',
+                                  fallback=alerts.SETTINGS['error_rate']),
+    'error_min_tasks': config.getint(
+        'alerts', 'error_min_tasks',
+        fallback=alerts.SETTINGS['error_min_tasks']),
+    'disk_min_available': config.getint(
+        'alerts', 'disk_min_available',
+        fallback=alerts.SETTINGS['disk_min_available']),
+    'deadline_min_tasks': config.getint(
+        'alerts', 'deadline_min_tasks',
+        fallback=alerts.SETTINGS['deadline_min_tasks']),
+    'network_suspended': config.getboolean(
+        'alerts', 'network_suspended',
+        fallback=alerts.SETTINGS['network_suspended'])
+}
+ALERT_EVENTS = alerts.StreamSink(config.getint('alerts', 'events',
+                                               fallback=200))
+ALERTS = alerts.AlertEngine(alerts.RULES, [alerts.LogSink(), ALERT_EVENTS],
+                            ALERT_SETTINGS)
+if config.get('alerts', 'webhook', fallback=''):
+    ALERTS.sinks.append(alerts.WebhookSink(config.get('alerts', 'webhook')))
+
+# Seconds between the keep-alive comments of /alerts/stream
+ALERT_STREAM_KEEPALIVE = 15
+
+# Time since each host that couldn't be reached has been so, see dueHosts()
+UNREACHABLE_SINCE = {}
+
+# Days of history shown by /analytics by default, and at most
+ANALYTICS_DAYS = 30
+ANALYTICS_MAX_DAYS = 366
+
+# Last rendered response of each (endpoint, variant), as
+# (etag, body, mimetype, {encoding: compressed body}), so it's rendered and
+# compressed once per dataset version no matter how many clients poll. Only
+# the RENDER_CACHE_SIZE used last are kept, variants coming from requests.
+renderCache = OrderedDict()
+RENDER_CACHE_SIZE = 64
+RENDER_CACHE_LOCK = threading.Lock()
+
+# Smaller responses are sent uncompressed
+COMPRESS_MIN_SIZE = config.getint(
+    'application', 'compress_min_size', fallback=1024)
+
+# collector.Subscriber feeding this process, when running as a web worker of
+# the production setup
+SUBSCRIBER = None
+
+# taskindex.TaskIndex of the current task rows, see taskIndex()
+TASK_INDEX = None
+TASK_INDEX_LOCK = threading.Lock()
+
+# search.SearchIndex of the tasks, work units and projects, see searchIndex()
+SEARCH_INDEX = search.SearchIndex()
+SEARCH_LOCK = threading.Lock()
+
+# Search attributes, and the document fields holding their values
+SEARCH_ATTRIBUTES = {
+    'host': ('host',),
+    'project': ('project', 'projectURL'),
+    'app': ('app', 'application'),
+    'plan_class': ('plan_class',),
+    'state': ('state',)
+}
+
+# Documents returned by /search by default, and at most
+SEARCH_LIMIT = 100
+SEARCH_MAX_LIMIT = 1000
+
+# Seconds of queued work per processor under which a host is starved, and
+# over which it's overloaded, see balance.py
+QUEUE_LOW = config.getint('application', 'queue_low', fallback=balance.QUEUE_LOW)
+QUEUE_HIGH = config.getint('application', 'queue_high',
+                           fallback=balance.QUEUE_HIGH)
+# project_op operations /balance applies
+PROJECT_OPS = ('allowmorework', 'nomorework')
+
+# Operations users may request on a host, with the types of their
+# arguments, see hostCommand()
+HOST_COMMANDS = {
+    'set_run_mode': (int,),
+    'set_gpu_mode': (int,),
+    'set_network_mode': (int,),
+    'project_op': (str, str)
+}
+
+# Seconds between the disk usage samples kept of each host, and seconds of
+# the last ones the time until its disk is full is projected from
+DISK_SAMPLE_INTERVAL = config.getint(
+    'application', 'disk_sample_interval', fallback=diskusage.SAMPLE_INTERVAL)
+DISK_TREND_WINDOW = config.getint(
+    'application', 'disk_trend_window', fallback=diskusage.TREND_WINDOW)
+
+# Measures the file transfers as they're polled
+TRANSFERS = xfers.TransferMonitor(config.getint(
+    'application', 'transfer_stall_timeout', fallback=xfers.STALL_TIMEOUT))
+
+# Projects the completion of the tasks as their rows are refreshed
+DEADLINES = deadlines.DeadlineEngine(config.getint(
+    'application', 'deadline_margin', fallback=deadlines.RISK_MARGIN))
+
+# Seconds between full task refreshes, fast (active tasks only) ones go between
+FULL_REFRESH_INTERVAL = config.getint(
+    'application', 'full_refresh_interval', fallback=60)
+# Time of the last full cycle, which also refreshes the state and starts a
+# new symbol table, and of the last full refresh of each host: hosts aren't
+# all due in the same cycles, see dueHosts()
+LAST_FULL_TASK_CYCLE = 0.0
+LAST_FULL_TASK_REFRESH = {}
 
 network_status_icon_map = {
     client.NetworkStatus.UNKNOWN.value: 'fa-question',
@@ -212,24 +873,183 @@ netModeDescMap = {
 }
 
 
-def updateStatus():
-    global hostConnectionsMap
-    for host, password in config['hosts'].items():
+def refresh(names, force=False):
+    ''' Bring the named datasets up to date. When a collector process owns
+        the BOINC connections (see collector.py) this only asks it for a
+        forced refresh, otherwise the update functions poll the hosts
+        right away, subject to REFRESH_INTERVAL unless forced
+    '''
+    if SUBSCRIBER:
+        if force:
+            SUBSCRIBER.request(names)
+        return
+
+    for name in names:
+        # restored data is served as is while warmUp() replaces it, and
+        # polled as usual after, should warmUp() have failed to
+        if (not force and not WARMED_UP.is_set()
+                and snapshot.current().datasets[name].restored):
+            continue
+
+        with UPDATE_LOCKS[name]:
+            UPDATERS[name](force=force)
+
+
+def restoreSnapshot():
+    ''' Install the snapshot saved by a previous run, if any, and save the
+        current one every SNAPSHOT_SAVE_INTERVAL seconds from now on.
+        Return whether something was restored.
+    '''
+    global SNAPSHOT_STORE
+
+    if not SNAPSHOT_FILE or SNAPSHOT_STORE:
+        return False
+
+    SNAPSHOT_STORE = store.SnapshotStore(SNAPSHOT_FILE, DATASET_FIELDS)
+    SNAPSHOT_STORE.start(SNAPSHOT_SAVE_INTERVAL)
+
+    try:
+        snap = SNAPSHOT_STORE.load()
+    except sqlite3.Error as error:
+        LOGGER.error(f"Couldn't restore snapshot from {SNAPSHOT_FILE}: {error}")
+        return False
+
+    if not snap:
+        return False
+
+    snapshot.install(snap)
+    LOGGER.info(f"Restored snapshot from {SNAPSHOT_FILE}")
+    return True
+
+
+def warmUp():
+    ''' Refresh every dataset in turn, replacing the restored ones '''
+    for name in DATASET_NAMES:
+        try:
+            refresh([name], force=True)
+        except Exception:
+            LOGGER.exception(f"Couldn't refresh {name}")
+    WARMED_UP.set()
+
+
+def hostCommand(host, name, *args):
+    ''' Do the HOST_COMMANDS name with args on host, from the collector when
+        there is one, see runCommand()
+    '''
+    if SUBSCRIBER:
+        SUBSCRIBER.command(host, name, args)
+    else:
+        runCommand(host, name, args)
+
+
+def runCommand(host, name, args):
+    ''' Do the HOST_COMMANDS name with the list args on host, and return its
+        result, None if host can't be reached. Anything but a configured
+        host and a known command with arguments of the right types raises
+        ValueError.
+    '''
+    types = HOST_COMMANDS.get(name)
+    if (host not in config['hosts'] or types is None
+            or len(args) != len(types)
+            or not all(isinstance(arg, kind)
+                       for arg, kind in zip(args, types))
+            or (name == 'project_op' and args[1] not in PROJECT_OPS)):
+        raise ValueError(f"Invalid command {name}{tuple(args)} on {host}")
+
+    boincClient = hostClient(host, config['hosts'][host])
+    if not boincClient:
+        return None
+
+    if name == 'project_op':
+        # a Project of our own, project_op() changes it
+        project = client.Project()
+        project.master_url = args[0]
+        result = boincClient.project_op(project, args[1])
+    else:
+        result = getattr(boincClient, name)(*args)
+
+    LOGGER.info(f"{name} on {host} result: {result}")
+    return result
+
+
+def hostClient(host, password):
+    ''' Return the BoincClient of host, connecting it on first use, or None
+        if that first connection fails
+    '''
+    with CONNECTIONS_LOCK:
         if host in hostConnectionsMap:
-            boincClient = hostConnectionsMap[host]
+            return hostConnectionsMap[host]
+
+        boincClient = client.BoincClient(host=host, passwd=password,
+                                         **CLIENT_OPTIONS)
+        LOGGER.info(f"initiating connection for host {host}")
+
+        hostConnectionsMap[host] = boincClient
+
+    try:
+        boincClient.connect()
+    except (socket.timeout, OSError) as timeout:
+        LOGGER.info(f"Host {host} Timeout: {timeout}")
+        return None
+
+    return boincClient
+
+
+def replyCounts():
+    ''' Return how many RPC replies of all hosts were (reused, parsed) as
+        they were byte-identical to the previous ones or not
+    '''
+    with CONNECTIONS_LOCK:
+        clients = list(hostConnectionsMap.values())
+
+    return (sum(sum(c.reused.values()) for c in clients),
+            sum(sum(c.parsed.values()) for c in clients))
+
+
+def dueHosts(name, force=False):
+    ''' Yield (host, BoincClient) for each host due for a poll of the name
+        dataset, or all of them when forced. Once the caller is done with a
+        host, the digests of the replies to DATASET_CALLS[name] tell whether
+        its data changed, which sets when it's due next, see cadence.py.
+    '''
+    for host, password in config['hosts'].items():
+        if not (force or SCHEDULE.due(host, name)):
+            continue
+
+        boincClient = hostClient(host, password)
+
+        if not boincClient:
+            SCHEDULE.observe(host, name, None)
+            UNREACHABLE_SINCE.setdefault(host, time.time())
+            continue
+
+        yield host, boincClient
+
+        if boincClient.connected:
+            fingerprint = tuple(
+                boincClient.reply_digest(*((call,) if isinstance(call, str)
+                                           else call))
+                for call in DATASET_CALLS[name])
+            UNREACHABLE_SINCE.pop(host, None)
         else:
-            boincClient = client.BoincClient(host=host, passwd=password)
+            fingerprint = None
+            UNREACHABLE_SINCE.setdefault(host, time.time())
+        SCHEDULE.observe(host, name, fingerprint)
 
-            hostConnectionsMap[host] = boincClient
 
-            try:
-                boincClient.connect()
-            except (socket.timeout, OSError) as timeout:
-                LOGGER.info(f"Timeout: {timeout}")
-                continue
+def updateStatus(force=False):
+    snap = snapshot.current()
+
+    if not (force or snap.datasets['status'].stale()):
+        return
+
+    status = OrderedDict(snap.status)
 
+    for host, boincClient in dueHosts('status', force):
         if boincClient.connected:
-            host_state = boincClient.get_cc_status()
+            # reused replies are shared with the last snapshot, see
+            # client.BoincClient
+            host_state = copy.copy(boincClient.get_cc_status())
 
             LOGGER.debug(f'host_state: {host_state}')
 
@@ -242,33 +1062,30 @@ def updateStatus():
 
             host_state.network_status_icon = network_status_icon_map[host_state.network_status]
 
-            STATUS[host] = host_state
+            status[host] = host_state
 
+    snapshot.publish('status', status=status)
 
-def updateProjects():
-    global PROJECTS, projectMap, hostConnectionsMap
 
-    PROJECTS = []
+def updateProjects(force=False):
+    snap = snapshot.current()
 
-    for host, password in config['hosts'].items():
-        if host in hostConnectionsMap:
-            boincClient = hostConnectionsMap[host]
-        else:
-            boincClient = client.BoincClient(host=host, passwd=password)
+    if not (force or snap.datasets['projects'].stale()):
+        return
 
-            hostConnectionsMap[host] = boincClient
-
-            try:
-                boincClient.connect()
-            except (socket.timeout, OSError) as timeout:
-                LOGGER.info(f"Timeout: {timeout}")
-                continue
+    # hosts that aren't due keep their projects
+    projectsByHost = OrderedDict((host, []) for host in config['hosts'])
+    for project in snap.projects:
+        projectsByHost.setdefault(project.hostname, []).append(project)
+    projectMap = OrderedDict(snap.projectMap)
 
+    for host, boincClient in dueHosts('projects', force):
         if boincClient.connected:
             hostProjects = boincClient.get_project_status()
+            projectsByHost[host] = []
 
             if hostProjects:
-                for project in hostProjects:
+                for project in map(copy.copy, hostProjects):
                     project.hostname = host
 
                     statii = []
@@ -301,64 +1118,52 @@ def updateProjects():
                                       str(timedelta(seconds=int(project.min_rpc_time - time.time()))))
 
                     project.status = ', '.join(statii)
-                    PROJECTS.append(project)
+                    projectsByHost[host].append(project)
                     projectMap[project.master_url] = project
 
+    projects = tuple(project for hostProjects in projectsByHost.values()
+                     for project in hostProjects)
+    snapshot.publish('projects', projects=projects, projectMap=projectMap)
 
-def updateState():
-    global appMap, workUnitMap, hostConnectionsMap
 
-    for host, password in config['hosts'].items():
-        if host in hostConnectionsMap:
-            boincClient = hostConnectionsMap[host]
-        else:
-            boincClient = client.BoincClient(host=host, passwd=password)
+def updateState(force=False):
+    snap = snapshot.current()
 
-            hostConnectionsMap[host] = boincClient
+    if not (force or snap.datasets['state'].stale()):
+        return
 
-            try:
-                boincClient.connect()
-            except (socket.timeout, OSError) as timeout:
-                LOGGER.info(f"Host {host} Timeout: {timeout}")
-                continue
+    hostModelMap = dict(snap.hostModelMap)
 
+    for host, boincClient in dueHosts('state', force):
         if boincClient.connected:
+            digest = boincClient.reply_digest('get_state')
             stateInfo = boincClient.get_state()
 
-            for app in stateInfo.apps:
-                appMap[app.name] = {
-                    "user_friendly_name": app.user_friendly_name,
-                    "non_cpu_intensive": app.non_cpu_intensive
-                }
-
-            for wu in stateInfo.work_units:
-                workUnitMap[wu.name] = {
-                    "app_name": wu.app_name,
-                    "version_num": wu.version_num,
-                    "command_line": wu.command_line
-                }
+            if (INCREMENTAL_STATE and host in hostModelMap
+                    and digest is not None
+                    and boincClient.reply_digest('get_state') == digest):
+                # the very reply the model was built from, see CCState.diff()
+                continue
+            if INCREMENTAL_STATE and host in hostModelMap:
+                hostModelMap[host] = hostModelMap[host].update(stateInfo)
+            else:
+                hostModelMap[host] = model.HostModel.build(stateInfo)
         else:
             LOGGER.info(
                 f"Connection lost, couldn't update state for host {host}")
 
+    snapshot.publish('state', hostModelMap=hostModelMap)
 
-def updateHosts():
-    global hostMap, hostConnectionsMap
 
-    for host, password in config['hosts'].items():
-        if host in hostConnectionsMap:
-            boincClient = hostConnectionsMap[host]
-        else:
-            boincClient = client.BoincClient(host=host, passwd=password)
+def updateHosts(force=False):
+    snap = snapshot.current()
 
-            hostConnectionsMap[host] = boincClient
+    if not (force or snap.datasets['hosts'].stale()):
+        return
 
-            try:
-                boincClient.connect()
-            except (socket.timeout, OSError) as timeout:
-                LOGGER.info(f"Host {host} Timeout: {timeout}")
-                continue
+    hostMap = OrderedDict(snap.hostMap)
 
+    for host, boincClient in dueHosts('hosts', force):
         if boincClient.connected:
             hostInfo = boincClient.get_host_info()
             gpu = "--"
@@ -384,254 +1189,553 @@ def updateHosts():
                 'osName': hostInfo.os_name,
                 'osVersion': hostInfo.os_version,
                 'gpu': gpu,
+                'ngpus': sum(proc.count for proc in hostInfo.coprocs),
                 'boincVersion': boincClient.version
             }
 
+    snapshot.publish('hosts', hostMap=hostMap)
 
-def updateTasks():
-    global TASKS, projectMap, tasksByHostMap, hostConnectionsMap
 
-    updateProjects()
+def updateTasks(fast=False, force=False):
+    ''' Refresh the task rows. A full refresh fetches every result of every
+        host, while a fast one only fetches the active tasks, along with the
+        projects, through get_simple_gui_info and merges them into the rows
+        of the last full refresh. Hosts whose last full refresh is
+        FULL_REFRESH_INTERVAL old get one even in a fast refresh. Use
+        refreshTasks() to alternate both.
+    '''
+    global LAST_FULL_TASK_CYCLE
 
-    TASKS = []
-    tasksByHostMap = {}
+    if not (force or snapshot.current().datasets['tasks'].stale()):
+        return
 
-    for host, password in config['hosts'].items():
-        hostTasks = []
+    if not fast:
+        refresh(['projects'])
 
-        if host in hostConnectionsMap:
-            boincClient = hostConnectionsMap[host]
-        else:
-            boincClient = client.BoincClient(host=host, passwd=password)
-            LOGGER.info(f"initiating connection for host {host}")
-
-            hostConnectionsMap[host] = boincClient
+    snap = snapshot.current()
+    taskRowsByHostMap = dict(snap.taskRowsByHostMap)
 
-            try:
-                boincClient.connect()
-            except (socket.timeout, OSError) as timeout:
-                LOGGER.info(f"Host {host} Timeout: {timeout}")
-                continue
+    if fast:
+        # only to name the projects of the new tasks, the projects dataset
+        # stays the one of updateProjects()
+        projectMap = OrderedDict(snap.projectMap)
+        tasksByHostMap = dict(snap.tasksByHostMap)
+        symbols = snap.symbols
+    else:
+        projectMap = snap.projectMap
+        tasksByHostMap = {}
+        symbols = SymbolTable()
 
-        hostTasks = boincClient.get_results()
+    refreshed = set()
 
-        tasksByHostMap[host] = {'tasks': len(hostTasks)}
+    for host, boincClient in dueHosts('tasks', force):
+        hostTasks = []
+        now = time.time()
+        full = (not fast or now - LAST_FULL_TASK_REFRESH.get(host, 0.0)
+                >= FULL_REFRESH_INTERVAL)
+
+        try:
+            if full:
+                hostTasks, cc_status = boincClient.batch(
+                    [('get_results', False), 'get_cc_status'])
+            else:
+                (hostProjects, hostTasks), cc_status = boincClient.batch(
+                    ['get_simple_gui_info', 'get_cc_status'])
+        except (socket.timeout, OSError) as error:
+            LOGGER.info(f"Host {host} couldn't refresh tasks: {error}")
+            continue
 
-        cc_status = boincClient.get_cc_status()
         LOGGER.info(f"{host}: {len(hostTasks)}")
 
-        for task in hostTasks:
-            projectName = "Unknown"
-
-            percent_complete = round(task.fraction_done * 100, 3)
-            state = "Ready to start"
-            elapsed = task.elapsed_time
-
-            project = projectMap[task.project_url]
-
-            throttled = cc_status.task_suspend_reason & 64
+        if full:
+            LAST_FULL_TASK_REFRESH[host] = now
+            tasksByHostMap[host] = {'tasks': len(hostTasks)}
+            rows = OrderedDict()
+        else:
+            for project in hostProjects:
+                projectMap[project.master_url] = project
 
-            if task.coproc_missing:
-                state = "GPU Missing, "
+            rows = OrderedDict(taskRowsByHostMap.get(host, ()))
 
-            if task.state == client.ResultState.NEW:
-                state = "New"
-            elif task.state == client.ResultState.FILES_DOWNLOADING:
-                if task.ready_to_report:
-                    state = "Download failed"
-                else:
-                    state = "Downloading"
+        hostModel = snap.hostModelMap.get(host)
+        for task in hostTasks:
+            if hostModel is not None:
+                hostModel.resolve(task)
+            rows[task.name] = buildTask(host, task, cc_status, projectMap,
+                                        symbols)
+
+        taskRowsByHostMap[host] = rows
+        refreshed.add(host)
+
+    if not fast:
+        LAST_FULL_TASK_CYCLE = time.time()
+
+        # the rows kept for the other hosts move to the new symbol table
+        for host, rows in taskRowsByHostMap.items():
+            if host not in refreshed:
+                taskRowsByHostMap[host] = OrderedDict(
+                    (name, internRow(row, symbols)) for name, row in rows.items())
+                tasksByHostMap[host] = snap.tasksByHostMap.get(
+                    host, {'tasks': len(rows)})
+
+    tasks = tuple(row for rows in taskRowsByHostMap.values()
+                  for row in rows.values())
+
+    # projections only change with the rows, see deadlines.py
+    taskRisks = dict(snap.taskRisks)
+    for host in refreshed:
+        taskRisks[host] = DEADLINES.assess(host, taskRowsByHostMap[host])
+
+    snapshot.publish('tasks', tasks=tasks,
+                     taskRowsByHostMap=taskRowsByHostMap,
+                     tasksByHostMap=tasksByHostMap, symbols=symbols,
+                     taskRisks=taskRisks)
+
+
+def internRow(row, symbols):
+    ''' Return a copy of a task row with its strings from symbols '''
+    return dict(row, **{field: symbols.intern(row[field])
+                        for field in TASK_SYMBOL_FIELDS})
+
+
+def taskIndex(snap):
+    ''' Return the taskindex.TaskIndex of the task rows of snap '''
+    global TASK_INDEX
+
+    with TASK_INDEX_LOCK:
+        if TASK_INDEX is None or TASK_INDEX.tasks is not snap.tasks:
+            TASK_INDEX = taskindex.TaskIndex(snap.tasks, findTasks)
+        return TASK_INDEX
+
+
+def findTasks(query):
+    ''' Yield the (host, name) of the tasks matching query '''
+    for document in searchIndex().find(query, kind='task')[1]:
+        yield document['host'], document['name']
+
+
+def searchIndex():
+    ''' Return SEARCH_INDEX, brought up to date with the current snapshot.
+        Only the documents of the hosts whose data changed are rebuilt.
+    '''
+    with SEARCH_LOCK:
+        snap = snapshot.current()
+
+        projectsByHost = {}
+        for project in snap.projects:
+            projectsByHost.setdefault(project.hostname, []).append(project)
+
+        for host in config['hosts']:
+            hostModel = snap.hostModelMap.get(host)
+            rows = snap.taskRowsByHostMap.get(host, {})
+            projects = tuple(projectsByHost.get(host, ()))
+            workUnits = hostModel.indexes['work_units'] if hostModel else {}
+
+            SEARCH_INDEX.replace('task', host, rows, lambda: (
+                searchEntry(document, [row[field] for field
+                                       in taskindex.SEARCH_FIELDS])
+                for row, document in taskDocuments(host, rows, hostModel)))
+            SEARCH_INDEX.replace('project', host, projects, lambda: (
+                searchEntry({'kind': 'project', 'host': host,
+                             'name': project.project_name,
+                             'project': project.project_name,
+                             'projectURL': project.master_url},
+                            [project.project_name, project.master_url])
+                for project in projects))
+            SEARCH_INDEX.replace('workunit', host, workUnits, lambda: (
+                searchEntry(document, [document['name'], document['app'],
+                                       document['application']])
+                for document in workUnitDocuments(host, hostModel,
+                                                  snap.projectMap)))
+
+        return SEARCH_INDEX
+
+
+def searchEntry(document, texts):
+    ''' Return the (document, texts, attributes) of a search.SearchIndex
+        entry, its attributes being taken from the document
+    '''
+    return document, texts, {
+        attribute: [document[field] for field in fields if document.get(field)]
+        for attribute, fields in SEARCH_ATTRIBUTES.items()}
+
+
+def taskDocuments(host, rows, hostModel):
+    ''' Yield (row, search document) for the task rows of host '''
+    for row in rows.values():
+        app = planClass = ""
+        result = hostModel.lookup_result(row['name']) if hostModel else None
+        if result is not None:
+            planClass = result.plan_class
+            workUnit = hostModel.lookup_wu(result.wu_name)
+            if workUnit is not None:
+                app = workUnit.app_name
+
+        yield row, {
+            'kind': 'task',
+            'host': host,
+            'name': row['name'],
+            'project': row['projectName'],
+            'projectURL': row['projectURL'],
+            'app': app,
+            'application': row['application'],
+            'plan_class': planClass,
+            'state': row['state'],
+            'status': row['status']
+        }
+
+
+def workUnitDocuments(host, hostModel, projectMap):
+    ''' Yield the search documents of the work units of host '''
+    if hostModel is None:
+        return
+
+    # work units only know their project through their results
+    projectURLs = {result.wu_name: result.project_url
+                   for result in hostModel.indexes['results'].values()}
+
+    for workUnit in hostModel.indexes['work_units'].values():
+        app = hostModel.lookup_app(workUnit.app_name)
+        projectURL = projectURLs.get(workUnit.name, "")
+        project = projectMap.get(projectURL)
+
+        yield {
+            'kind': 'workunit',
+            'host': host,
+            'name': workUnit.name,
+            'project': project.project_name if project else "",
+            'projectURL': projectURL,
+            'app': workUnit.app_name,
+            'application': app.user_friendly_name if app else "",
+            'version_num': workUnit.version_num
+        }
+
+
+def tasksPage(snap, args):
+    ''' Answer a DataTables server-side processing request for the task
+        rows of snap, args being its query string. Besides the search box,
+        the rows can be filtered by the taskindex.FILTER_FIELDS given as
+        arguments of the same name.
+    '''
+    index = taskIndex(snap)
+
+    # only the first ordering column is honored
+    field = args.get('columns[%s][data]' % args.get('order[0][column]'))
+    if field not in taskindex.SORT_FIELDS:
+        field = None
+    filters = {field: args[field] for field in taskindex.FILTER_FIELDS
+               if args.get(field)}
+
+    count, rows = index.page(
+        max(args.get('start', 0, type=int), 0),
+        args.get('length', 100, type=int),
+        field, args.get('order[0][dir]') == 'desc', filters,
+        args.get('search[value]', ''))
+
+    return {
+        'draw': args.get('draw', 0, type=int),
+        'recordsTotal': len(snap.tasks),
+        'recordsFiltered': count,
+        'data': rows,
+        'facets': {field: index.values(field)
+                   for field in taskindex.FILTER_FIELDS}
+    }
+
+
+def refreshTasks(force=False):
+    ''' Refresh state and task rows fully every FULL_REFRESH_INTERVAL
+        seconds, and only the active tasks in between
+    '''
+    if not (force or snapshot.current().datasets['tasks'].stale()):
+        return
+
+    if time.time() - LAST_FULL_TASK_CYCLE >= FULL_REFRESH_INTERVAL:
+        refresh(['state'], force)
+        updateTasks(force=force)
+    else:
+        updateTasks(fast=True, force=force)
+
+
+def exportRecords(old=False):
+    ''' Yield the JSON lines of each host in turn, as it answers: one per
+        task, then per old result if old, or a single error line for a host
+        that couldn't be reached. Only the replies of one host are held at a
+        time, and each host's lines are one chunk, flushed by
+        compression.compress_stream() as a whole. Web workers fed by the
+        collector don't poll the hosts themselves, see snapshotRecords().
+    '''
+    if SUBSCRIBER:
+        yield from snapshotRecords(old)
+        return
+
+    snap = snapshot.current()
+    symbols = SymbolTable()
+    calls = [('get_results', False), 'get_cc_status']
+    if old:
+        calls.append('get_old_results')
 
-                    if cc_status.network_suspend_reason:
-                        state += " (suspended - %s)" % cc_status.network_suspend_reason
-            elif task.state == client.ResultState.FILES_DOWNLOADED:
-                if task.project_suspended_via_gui:
-                    state = "Project suspended by user"
-                elif task.suspended_via_gui:
-                    state = "Task suspended by user"
-                elif cc_status.task_suspend_reason and not throttled and task.active_task_state != 1:
-                    state = f"Suspended - {client.SuspendReason.name(cc_status.task_suspend_reason)}"
-                elif cc_status.gpu_suspend_reason and 'GPU' in task.resources:
-                    state = "GPU suspended - %s" % client.SuspendReason.name(
-                        cc_status.gpu_suspend_reason)
-                elif task.active_task:
-                    if task.too_large:
-                        state = "Waiting for memory"
-                    elif task.needs_shmem:
-                        state = "Waiting for shared memory"
-                    elif task.scheduler_state == 2:
-                        state = "Running"
-                        if project and project.non_cpu_intensive:
-                            state += " (non-CPU-intensive)"
-                    elif task.scheduler_state == 1:
-                        state = "Waiting to run"
-                    elif task.scheduler_state == 0:
-                        state = "Ready to start"
-                else:
-                    state = "Ready to start"
-                if task.scheduler_wait:
-                    if task.scheduler_wait_reason:
-                        state = "Postponed: %s" % task.scheduler_wait_reason
-                    else:
-                        state = "Postponed"
-                if task.network_wait:
-                    state = "Waiting for network access"
-            elif task.state == client.ResultState.COMPUTE_ERROR:
-                state = "Computation error"
-            elif task.state == client.ResultState.FILES_UPLOADING:
-                if task.ready_to_report:
-                    state = "Upload failed"
-                else:
-                    state = "Uploading"
-                    if cc_status.network_suspend_reason:
-                        state += " (suspended - %s)" % cc_status.network_suspend_reason
-            elif task.state == client.ResultState.ABORTED:
-                if task.exit_status == 203:
-                    state = "Aborted by user"
-                elif task.exit_status == 202:
-                    state = "Aborted by project"
-                elif task.exit_status == 200:
-                    state = "Aborted: not started by deadline"
-                elif task.exit_status == 196:
-                    state = "Aborted: task disk limit exceeded"
-                elif task.exit_status == 197:
-                    state = "Aborted: run time limit exceeded"
-                elif task.exit_status == 198:
-                    state = "Aborted: memory limit exceeded"
-                else:
-                    state = "Aborted"
+    for host, password in config['hosts'].items():
+        boincClient = hostClient(host, password)
+
+        try:
+            if not boincClient:
+                raise ConnectionError("couldn't connect")
+            replies = boincClient.batch(calls)
+        except OSError as error:
+            yield json.dumps({'type': 'error', 'host': host,
+                              'error': str(error)}) + '\n'
+            continue
+
+        lines = []
+        hostTasks, cc_status = replies[:2]
+        hostModel = snap.hostModelMap.get(host)
+        for task in hostTasks:
+            if hostModel is not None:
+                hostModel.resolve(task)
+            row = buildTask(host, task, cc_status, snap.projectMap, symbols)
+            lines.append(json.dumps(dict(row, type='task')) + '\n')
+
+        if old:
+            for result in replies[2]:
+                lines.append(json.dumps(dict(result.as_dict(),
+                                             type='old_result',
+                                             host=host)) + '\n')
+
+        yield ''.join(lines)
+
+
+def snapshotRecords(old=False):
+    ''' Yield the lines of exportRecords() from the task rows of the current
+        snapshot and, if old, the old results of HISTORY the core clients
+        would still report. Hosts without any task rows get an error line.
+    '''
+    snap = snapshot.current()
+    since = time.time() - history.OLD_RESULTS_KEPT
+
+    for host in config['hosts']:
+        rows = snap.taskRowsByHostMap.get(host)
+        if rows is None:
+            yield json.dumps({'type': 'error', 'host': host,
+                              'error': "no tasks collected"}) + '\n'
+            continue
+
+        lines = [json.dumps(dict(row, type='task')) + '\n'
+                 for row in rows.values()]
+        if old:
+            lines.extend(json.dumps(dict(result, type='old_result',
+                                         host=host)) + '\n'
+                         for result in HISTORY.results(host, since))
+
+        yield ''.join(lines)
+
+
+def buildTask(host, task, cc_status, projectMap, symbols):
+    ''' Build the task row of a client.Result, resolved against the
+        model.HostModel of host if known
+    '''
+    projectName = "Unknown"
+
+    percent_complete = round(task.fraction_done * 100, 3)
+    state = "Ready to start"
+    elapsed = task.elapsed_time
+
+    project = projectMap.get(task.project_url)
+
+    throttled = cc_status.task_suspend_reason & 64
+
+    if task.coproc_missing:
+        state = "GPU Missing, "
+
+    if task.state == client.ResultState.NEW:
+        state = "New"
+    elif task.state == client.ResultState.FILES_DOWNLOADING:
+        if task.ready_to_report:
+            state = "Download failed"
+        else:
+            state = "Downloading"
+
+            if cc_status.network_suspend_reason:
+                state += " (suspended - %s)" % cc_status.network_suspend_reason
+    elif task.state == client.ResultState.FILES_DOWNLOADED:
+        if task.project_suspended_via_gui:
+            state = "Project suspended by user"
+        elif task.suspended_via_gui:
+            state = "Task suspended by user"
+        elif cc_status.task_suspend_reason and not throttled and task.active_task_state != 1:
+            state = f"Suspended - {client.SuspendReason.name(cc_status.task_suspend_reason)}"
+        elif cc_status.gpu_suspend_reason and 'GPU' in task.resources:
+            state = "GPU suspended - %s" % client.SuspendReason.name(
+                cc_status.gpu_suspend_reason)
+        elif task.active_task:
+            if task.too_large:
+                state = "Waiting for memory"
+            elif task.needs_shmem:
+                state = "Waiting for shared memory"
+            elif task.scheduler_state == 2:
+                state = "Running"
+                if project and project.non_cpu_intensive:
+                    state += " (non-CPU-intensive)"
+            elif task.scheduler_state == 1:
+                state = "Waiting to run"
+            elif task.scheduler_state == 0:
+                state = "Ready to start"
+        else:
+            state = "Ready to start"
+        if task.scheduler_wait:
+            if task.scheduler_wait_reason:
+                state = "Postponed: %s" % task.scheduler_wait_reason
             else:
-                if task.got_server_ack:
-                    state = "Acknowledged"
-                elif task.ready_to_report:
-                    state = "Ready to report"
-                else:
-                    state = "Error: invalid state '%d'" % task.state
-
-            # if task.active_task_state and task.active_task_state == 1:
-            #     state = "Running"
-            if task.estimated_cpu_time_remaining == 0:
-                percent_complete = 100
-                elapsed = task.final_elapsed_time
-
-            resourceString = ""
+                state = "Postponed"
+        if task.network_wait:
+            state = "Waiting for network access"
+    elif task.state == client.ResultState.COMPUTE_ERROR:
+        state = "Computation error"
+    elif task.state == client.ResultState.FILES_UPLOADING:
+        if task.ready_to_report:
+            state = "Upload failed"
+        else:
+            state = "Uploading"
+            if cc_status.network_suspend_reason:
+                state += " (suspended - %s)" % cc_status.network_suspend_reason
+    elif task.state == client.ResultState.ABORTED:
+        if task.exit_status == 203:
+            state = "Aborted by user"
+        elif task.exit_status == 202:
+            state = "Aborted by project"
+        elif task.exit_status == 200:
+            state = "Aborted: not started by deadline"
+        elif task.exit_status == 196:
+            state = "Aborted: task disk limit exceeded"
+        elif task.exit_status == 197:
+            state = "Aborted: run time limit exceeded"
+        elif task.exit_status == 198:
+            state = "Aborted: memory limit exceeded"
+        else:
+            state = "Aborted"
+    else:
+        if task.got_server_ack:
+            state = "Acknowledged"
+        elif task.ready_to_report:
+            state = "Ready to report"
+        else:
+            state = "Error: invalid state '%d'" % task.state
 
-            if task.resources:
-                resourceString = " (%s)" % task.resources
+    # if task.active_task_state and task.active_task_state == 1:
+    #     state = "Running"
+    if task.estimated_cpu_time_remaining == 0:
+        percent_complete = 100
+        elapsed = task.final_elapsed_time
 
-            statusString = "%s%s" % (state, resourceString)
+    resourceString = ""
 
-            try:
-                projectName = projectMap[task.project_url].project_name
-            except KeyError as error:
-                LOGGER.error(f"Couldn't find key: {error}")
+    if task.resources:
+        resourceString = " (%s)" % task.resources
 
-            deadline = datetime.fromtimestamp(task.report_deadline)
+    statusString = "%s%s" % (state, resourceString)
 
-            days = elapsed // 86600
-            elapsedLeft = elapsed - days * 86600
-            hours = int(elapsedLeft // 3600)
-            elapsedLeft -= hours * 3600
-            minutes = int(elapsedLeft // 60)
-            seconds = int(elapsedLeft - minutes * 60)
+    try:
+        projectName = projectMap[task.project_url].project_name
+    except KeyError as error:
+        LOGGER.error(f"Couldn't find key: {error}")
 
-            elapsedTime = "%s:%s:%s" % (str(hours).zfill(
-                2), str(minutes).zfill(2), str(seconds).zfill(2))
+    deadline = datetime.fromtimestamp(task.report_deadline)
 
-            if days:
-                elapsedTime = "%dd %s:%s:%s" % (days, str(hours).zfill(
-                    2), str(minutes).zfill(2), str(seconds).zfill(2))
+    days = elapsed // 86600
+    elapsedLeft = elapsed - days * 86600
+    hours = int(elapsedLeft // 3600)
+    elapsedLeft -= hours * 3600
+    minutes = int(elapsedLeft // 60)
+    seconds = int(elapsedLeft - minutes * 60)
 
-            if task.estimated_cpu_time_remaining:
-                days = task.estimated_cpu_time_remaining // 86600
-                remainingLeft = task.estimated_cpu_time_remaining - days * 86600
-                hours = int(remainingLeft // 3600)
-                remainingLeft -= int(hours * 3600)
-                minutes = int(remainingLeft // 60)
-                seconds = int(remainingLeft - minutes * 60)
+    elapsedTime = "%s:%s:%s" % (str(hours).zfill(
+        2), str(minutes).zfill(2), str(seconds).zfill(2))
 
-                remaining = "%s:%s:%s" % (str(hours).zfill(2), str(
-                    minutes).zfill(2), str(seconds).zfill(2))
+    if days:
+        elapsedTime = "%dd %s:%s:%s" % (days, str(hours).zfill(
+            2), str(minutes).zfill(2), str(seconds).zfill(2))
 
-                if days:
-                    remaining = "%dd %s:%s:%s" % (days, str(hours).zfill(
-                        2), str(minutes).zfill(2), str(seconds).zfill(2))
-            else:
-                remaining = "--"
-
-            app = ""
-            friendly_name = ""
-            version = 0xdeadbeef
-
-            if task.wu_name in workUnitMap:
-                app = workUnitMap[task.wu_name]['app_name']
-                version_str = str(workUnitMap[task.wu_name]['version_num'])
-                version = '%s.%s' % (
-                    version_str[0], version_str[1:])
-
-            if app in appMap:
-                friendly_name = f"{appMap[app]['user_friendly_name']} {version}"
-
-                if task.plan_class:
-                    friendly_name += f" ({task.plan_class})"
-
-            TASKS.append({
-                'hostname': host,
-                'projectName': projectName,
-                'projectURL': task.project_url,
-                'percent': percent_complete,
-                'elapsedTime': elapsedTime,
-                'deadline': int(deadline.timestamp() * 1000),
-                'remaining': remaining,
-                'name': task.name,
-                'application': friendly_name,
-                'status': statusString,
-                'state': state
-            })
-
-
-def updateStatistics():
-    global statsMap, projectMap
+    if task.estimated_cpu_time_remaining:
+        days = task.estimated_cpu_time_remaining // 86600
+        remainingLeft = task.estimated_cpu_time_remaining - days * 86600
+        hours = int(remainingLeft // 3600)
+        remainingLeft -= int(hours * 3600)
+        minutes = int(remainingLeft // 60)
+        seconds = int(remainingLeft - minutes * 60)
 
-    for host, password in config['hosts'].items():
-        if host in hostConnectionsMap:
-            boincClient = hostConnectionsMap[host]
-        else:
-            boincClient = client.BoincClient(host=host, passwd=password)
-
-            hostConnectionsMap[host] = boincClient
-
-            try:
-                boincClient.connect()
-            except (socket.timeout, OSError) as timeout:
-                LOGGER.info(f"Host {host} Timeout: {timeout}")
-                continue
+        remaining = "%s:%s:%s" % (str(hours).zfill(2), str(
+            minutes).zfill(2), str(seconds).zfill(2))
 
+        if days:
+            remaining = "%dd %s:%s:%s" % (days, str(hours).zfill(
+                2), str(minutes).zfill(2), str(seconds).zfill(2))
+    else:
+        remaining = "--"
+
+    friendly_name = ""
+    version = 0xdeadbeef
+
+    if task.wup is not None:
+        version_str = str(task.wup.version_num)
+        version = '%s.%s' % (
+            version_str[0], version_str[1:])
+
+    if task.app is not None:
+        friendly_name = f"{task.app.user_friendly_name} {version}"
+
+        if task.plan_class:
+            friendly_name += f" ({task.plan_class})"
+
+    return {
+        'hostname': symbols.intern(host),
+        'projectName': symbols.intern(projectName),
+        'projectURL': symbols.intern(task.project_url),
+        'percent': percent_complete,
+        'elapsedTime': elapsedTime,
+        'elapsedSeconds': int(elapsed),
+        'deadline': int(deadline.timestamp() * 1000),
+        'remaining': remaining,
+        'remainingSeconds': int(task.estimated_cpu_time_remaining),
+        'name': task.name,
+        'application': symbols.intern(friendly_name),
+        'status': symbols.intern(statusString),
+        'state': symbols.intern(state)
+    }
+
+
+def updateStatistics(force=False):
+    snap = snapshot.current()
+
+    if not (force or snap.datasets['statistics'].stale()):
+        return
+
+    statsMap = OrderedDict(snap.statsMap)
+    projectMap = snap.projectMap
+
+    for host, boincClient in dueHosts('statistics', force):
         if boincClient.connected:
-            statistics = boincClient.get_statistics()
+            statistics = copy.copy(boincClient.get_statistics())
+            statistics.project_statistics = [
+                copy.copy(ps) for ps in statistics.project_statistics]
             for ps in statistics.project_statistics:
                 ps.project = projectMap[ps.master_url]
 
             statsMap[host] = statistics
 
+    snapshot.publish('statistics', statsMap=statsMap)
 
-def updateDiskUsage():
-    global diskUsageMap, projectMap
 
-    for host, password in config['hosts'].items():
-        if host in hostConnectionsMap:
-            boincClient = hostConnectionsMap[host]
-        else:
-            boincClient = client.BoincClient(host=host, passwd=password)
+def updateDiskUsage(force=False):
+    snap = snapshot.current()
 
-            hostConnectionsMap[host] = boincClient
+    if not (force or snap.datasets['disk'].stale()):
+        return
 
-            try:
-                boincClient.connect()
-            except (socket.timeout, OSError) as timeout:
-                LOGGER.info(f"Host {host} Timeout: {timeout}")
-                continue
+    diskUsageMap = OrderedDict(snap.diskUsageMap)
+    diskSamplesMap = dict(snap.diskSamplesMap)
+    projectMap = snap.projectMap
+    now = time.time()
 
+    for host, boincClient in dueHosts('disk', force):
         if boincClient.connected:
             disk_usage = boincClient.get_disk_usage()
 
@@ -646,35 +1750,61 @@ def updateDiskUsage():
             usage['available'] = disk_usage.d_allowed - usage['boinc']
             usage['not_available'] = usage['free'] - usage['available']
             usage['other'] = usage['total'] - usage['boinc'] - usage['free']
-            usage['projects'] = disk_usage.projects
+            usage['projects'] = [copy.copy(project)
+                                 for project in disk_usage.projects]
 
             for project in usage['projects']:
-                project.name = projectMap[project.master_url].project_name
+                known = projectMap.get(project.master_url)
+                project.name = known.project_name if known \
+                    else project.master_url
 
             diskUsageMap[host] = usage
-
-
-def updateTransfers():
-    global transferMap
-
-    for host, password in config['hosts'].items():
-        if host in hostConnectionsMap:
-            boincClient = hostConnectionsMap[host]
-        else:
-            boincClient = client.BoincClient(host=host, passwd=password)
-
-            hostConnectionsMap[host] = boincClient
-
-            try:
-                boincClient.connect()
-            except (socket.timeout, OSError) as timeout:
-                LOGGER.info(f"Host {host} Timeout: {timeout}")
-                continue
-
+            diskSamplesMap[host] = diskusage.add_sample(
+                diskSamplesMap.get(host, ()), diskusage.sample(now, usage),
+                DISK_SAMPLE_INTERVAL)
+
+    snapshot.publish('disk', diskUsageMap=diskUsageMap,
+                     diskSamplesMap=diskSamplesMap)
+
+
+def diskUsageHistory(snap):
+    ''' Return the disk usage of each host, with its samples and projected
+        time until the space available to BOINC runs out, and the usage of
+        each project summed over the cluster
+    '''
+    hosts = OrderedDict()
+    for host, usage in snap.diskUsageMap.items():
+        samples = snap.diskSamplesMap.get(host, ())
+        slope, timeToFull = diskusage.trend(samples, DISK_TREND_WINDOW)
+        summary = {key: value for key, value in usage.items()
+                   if key != 'projects'}
+        summary.update(trend=slope, timeToFull=timeToFull,
+                       samples=[dict(zip(diskusage.SAMPLE_FIELDS, sample))
+                                for sample in samples])
+        hosts[host] = summary
+
+    return {'hosts': hosts,
+            'projects': diskusage.by_project(snap.diskUsageMap,
+                                             snap.projectMap)}
+
+
+def updateTransfers(force=False):
+    snap = snapshot.current()
+
+    if not (force or snap.datasets['transfers'].stale()):
+        return
+
+    transferMap = OrderedDict(snap.transferMap)
+    transferRates = dict(snap.transferRates)
+    now = time.time()
+
+    for host, boincClient in dueHosts('transfers', force):
         if boincClient.connected:
-            transfers = boincClient.get_file_transfers()
+            transfers = [copy.copy(transfer)
+                         for transfer in boincClient.get_file_transfers()]
 
-            cc_status = boincClient.get_cc_status()
+            # the status dataset already polls it
+            cc_status = snap.status.get(host) or boincClient.get_cc_status()
 
             for transfer in transfers:
                 status = ""
@@ -686,8 +1816,8 @@ def updateTransfers():
 
                 status += ": "
 
-                if transfer.next_request_time > datetime.utcnow().timestamp():
-                    status += f"retry in {transfer.next_request_time - datetime.utcnow().timestamp()}"
+                if transfer.next_request_time > now:
+                    status += f"retry in {timedelta(seconds=int(transfer.next_request_time - now))}"
                 elif transfer.status == -114 or transfer.status == -115:
                     status += "failed"
                 else:
@@ -703,4 +1833,127 @@ def updateTransfers():
 
                 transfer.gui_status = status
 
+            transferRates[host] = TRANSFERS.measure(host, transfers, now)
+            for transfer in transfers:
+                if transfer.stalled:
+                    transfer.gui_status += " (stalled)"
+
             transferMap[host] = transfers
+
+    snapshot.publish('transfers', transferMap=transferMap,
+                     transferRates=transferRates)
+
+
+def updateResults(force=False):
+    ''' Add the old results of every host to HISTORY '''
+    if not (force or snapshot.current().datasets['results'].stale()):
+        return
+
+    added = 0
+
+    for host, boincClient in dueHosts('results', force):
+        if boincClient.connected:
+            added += HISTORY.ingest(host, boincClient.get_old_results())
+
+    LOGGER.info(f"Stored {added} old results")
+
+    snapshot.publish('results')
+
+
+def updateMessages(force=False):
+    ''' Add the event log messages and notices of every host that are newer
+        than the last ones stored to EVENTS, and to the latest ones of the
+        host in the snapshot
+    '''
+    snap = snapshot.current()
+
+    if not (force or snap.datasets['messages'].stale()):
+        return
+
+    messageMap = dict(snap.messageMap)
+    noticeMap = dict(snap.noticeMap)
+    addedMessages = addedNotices = 0
+
+    for host, boincClient in dueHosts('messages', force):
+        if boincClient.connected:
+            count, = boincClient.batch(['get_message_count'])
+            messageSeqno, noticeSeqno = EVENTS.since(host)
+            if count < messageSeqno:
+                LOGGER.info(f"{host} restarted, fetching all of its messages")
+                EVENTS.restart(host)
+                messageSeqno = noticeSeqno = 0
+
+            calls = [('get_notices', noticeSeqno)]
+            if count > messageSeqno:
+                calls.append(('get_messages', messageSeqno))
+            notices, *messages = boincClient.batch(calls)
+
+            # seqno -1 heads a complete list of the notices
+            complete = any(notice.seqno < 0 for notice in notices)
+            notices = sorted((eventlog.notice_record(host, notice)
+                              for notice in notices if notice.seqno >= 0),
+                             key=lambda record: record['seqno'])
+            messages = [eventlog.message_record(host, message)
+                        for message in (messages[0] if messages else ())]
+
+            newMessages, newNotices = EVENTS.ingest(host, messages, notices)
+            addedMessages += newMessages
+            addedNotices += newNotices
+
+            if messages:
+                messageMap[host] = eventlog.append(
+                    messageMap.get(host, ()), messages, MESSAGE_RING_SIZE)
+            if notices or complete:
+                noticeMap[host] = eventlog.append(
+                    () if complete else noticeMap.get(host, ()), notices,
+                    MESSAGE_RING_SIZE)
+
+    LOGGER.info(f"Stored {addedMessages} messages and {addedNotices} notices")
+
+    snapshot.publish('messages', messageMap=messageMap, noticeMap=noticeMap)
+
+
+def updateAlerts(force=False):
+    ''' Evaluate the rules of ALERTS for the hosts whose data changed since
+        the last time
+    '''
+    snap = snapshot.current()
+
+    if not (force or snap.datasets['alerts'].stale()):
+        return
+
+    # alerts restored from disk that still hold aren't raised again
+    if snap.alerts and not ALERTS.inputs:
+        ALERTS.restore(snap.alerts)
+
+    # the very same objects as long as their host isn't polled again
+    inputsByHost = {host: {
+        'unreachableSince': UNREACHABLE_SINCE.get(host),
+        'status': snap.status.get(host),
+        'disk': snap.diskUsageMap.get(host),
+        'tasks': snap.taskRowsByHostMap.get(host),
+        'risks': snap.taskRisks.get(host)
+    } for host in config['hosts']}
+
+    events = ALERTS.update(inputsByHost)
+    active = tuple(ALERTS.alerts())
+    if events or active != snap.alerts:
+        snapshot.publish('alerts', alerts=active,
+                         alertEvents=ALERT_EVENTS.recent())
+    else:
+        snapshot.publish('alerts')
+
+
+UPDATERS = OrderedDict([
+    ('status', updateStatus),
+    ('projects', updateProjects),
+    ('state', updateState),
+    ('hosts', updateHosts),
+    ('tasks', refreshTasks),
+    ('statistics', updateStatistics),
+    ('disk', updateDiskUsage),
+    ('transfers', updateTransfers),
+    ('results', updateResults),
+    ('messages', updateMessages),
+    ('alerts', updateAlerts),
+])
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# cadence.py - Adaptive polling intervals of the hosts
+#
+#    Copyright (C) 2020 Jonathan Drake (drakej) <952345+drakej@users.noreply.github.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+# A host crunching week-long CPU tasks answers the same thing poll after
+# poll, while one running short GPU tasks changes every few seconds. Each
+# (host, dataset) pair gets its own polling interval: back to the minimum as
+# soon as its replies change, and GROWTH times longer every time they don't,
+# up to the maximum. Hosts that can't be reached back off the same way.
+
+import threading
+import time
+
+GROWTH = 1.5
+
+
+class Cadence(object):
+    ''' Polling interval of one kind of data of one host '''
+
+    def __init__(self, minimum, maximum):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.interval = minimum
+        self.fingerprint = None
+        self.next = 0.0
+        self.polls = 0
+        self.changes = 0
+
+    def due(self, now=None):
+        return (time.time() if now is None else now) >= self.next
+
+    def observe(self, fingerprint, now=None):
+        ''' Record the fingerprint of the replies of a poll, None if the
+            host couldn't be reached, and schedule the next poll. Return
+            whether the replies changed.
+        '''
+        now = time.time() if now is None else now
+        changed = fingerprint is not None and fingerprint != self.fingerprint
+
+        if changed:
+            self.interval = self.minimum
+            self.changes += 1
+        else:
+            self.interval = min(self.maximum, self.interval * GROWTH)
+
+        self.fingerprint = fingerprint
+        self.polls += 1
+        self.next = now + self.interval
+        return changed
+
+
+class Schedule(object):
+    ''' Cadences of every (host, dataset) pair '''
+
+    def __init__(self, minimum, maximum):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.cadences = {}
+        self.lock = threading.Lock()
+
+    def cadence(self, host, name):
+        with self.lock:
+            key = (host, name)
+            if key not in self.cadences:
+                self.cadences[key] = Cadence(self.minimum, self.maximum)
+            return self.cadences[key]
+
+    def due(self, host, name):
+        return self.cadence(host, name).due()
+
+    def observe(self, host, name, fingerprint):
+        return self.cadence(host, name).observe(fingerprint)
+
+    def intervals(self):
+        ''' Return the current interval of each (host, dataset) '''
+        with self.lock:
+            return {key: cadence.interval
+                    for key, cadence in self.cadences.items()}
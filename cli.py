@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# cli.py - boinccmd-like command line over the whole cluster
+#
+#    Copyright (C) 2020 Jonathan Drake (drakej) <952345+drakej@users.noreply.github.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+# Runs one BoincClient operation against many hosts at once and writes the
+# results to stdout as each host answers, one JSON object (or CSV row) per
+# record, tagged with the host. Hosts and passwords come from config.ini.
+# Errors go to stderr, and make the exit status 1.
+#
+# Usage:
+#   python3 cli.py get_tasks --hosts all
+#   python3 cli.py set_run_mode never 3600 --hosts host1,host2
+#   python3 cli.py --host host1 --passwd secret --get_cc_status
+#   python3 cli.py project http://project/ nomorework --format csv
+
+import argparse
+import configparser
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import client
+import rpc
+
+# boinccmd options that are named differently in BoincClient
+ALIASES = {
+    'get_old_tasks': 'get_old_results',
+    'project': 'project_op',
+}
+
+# BoincClient methods that aren't operations of their own
+NOT_OPERATIONS = ('connect', 'disconnect', 'authorize', 'exchange_versions',
+                  'call', 'call_parsed', 'batch', 'reply_digest', 'set_mode',
+                  'as_dict')
+
+MODE_OPERATIONS = ('set_run_mode', 'set_gpu_mode', 'set_network_mode')
+
+MAX_PARALLEL = 32
+
+
+def operations():
+    return sorted(name for name in dir(client.BoincClient)
+                  if not name.startswith('_') and name not in NOT_OPERATIONS)
+
+
+def operation_arguments(operation, args):
+    ''' Convert the command line arguments of operation to the values
+        BoincClient expects
+    '''
+    values = []
+    for arg in args:
+        try:
+            values.append(int(arg))
+        except ValueError:
+            try:
+                values.append(float(arg))
+            except ValueError:
+                values.append(arg)
+
+    # boinccmd names modes: always, auto, never, restore
+    if operation in MODE_OPERATIONS and values and isinstance(values[0], str):
+        values[0] = client.RunMode[values[0].upper()].value
+
+    # boinccmd takes the project URL, BoincClient a Project
+    if operation == 'project_op' and values:
+        project = client.Project()
+        project.master_url = values[0]
+        values[0] = project
+
+    return values
+
+
+def records(host, result):
+    ''' Return the output records of the result of host: one per item of
+        lists, one for anything else
+    '''
+    if not isinstance(result, (list, tuple)):
+        result = [result]
+
+    for item in result:
+        value = client.plain_value(item)
+        if isinstance(value, dict):
+            yield dict(host=host, **value)
+        else:
+            yield {'host': host, 'result': value}
+
+
+def run(host, password, operation, args, options):
+    ''' Do operation on host, return its list of records '''
+    boincClient = client.BoincClient(host=host, passwd=password,
+                                     timeout=options.timeout,
+                                     **client.client_options(options.config))
+    boincClient.connect()
+    if not boincClient.connected:
+        raise ConnectionError("couldn't connect")
+
+    try:
+        return list(records(host, getattr(boincClient, operation)(*args)))
+    finally:
+        boincClient.disconnect()
+
+
+class Writer(object):
+    ''' Writes records to a stream in NDJSON or CSV, the columns of the CSV
+        being the fields of the first record
+    '''
+
+    def __init__(self, stream, format):
+        self.stream = stream
+        self.format = format
+        self.csv = None
+
+    def write(self, rows):
+        for row in rows:
+            if self.format == 'csv':
+                self.write_csv(row)
+            else:
+                self.stream.write(json.dumps(row) + '\n')
+        self.stream.flush()
+
+    def write_csv(self, row):
+        if self.csv is None:
+            self.csv = csv.DictWriter(self.stream, list(row),
+                                      extrasaction='ignore')
+            self.csv.writeheader()
+        self.csv.writerow({key: json.dumps(value)
+                           if isinstance(value, (dict, list)) else value
+                           for key, value in row.items()})
+
+
+def parse_args(argv):
+    # boinccmd style: --get_tasks is the operation, not an option
+    names = set(operations()) | set(ALIASES)
+    argv = [arg[2:] if arg.startswith('--') and arg[2:] in names else arg
+            for arg in argv]
+
+    parser = argparse.ArgumentParser(
+        description='Run a BoincClient operation on many hosts at once',
+        epilog='operations: ' + ', '.join(operations()))
+    parser.add_argument('operation')
+    parser.add_argument('args', nargs='*')
+    parser.add_argument('--hosts', default='all',
+                        help="comma separated hosts of config.ini, or 'all'")
+    parser.add_argument('--host', action='append', default=[],
+                        help='host to use instead of the configured ones')
+    parser.add_argument('--passwd', default=None,
+                        help='password of the --host hosts')
+    parser.add_argument('--config', default='config.ini')
+    parser.add_argument('--format', choices=('ndjson', 'csv'),
+                        default='ndjson')
+    parser.add_argument('--timeout', type=float, default=rpc.GUI_RPC_TIMEOUT,
+                        help='socket timeout of each host, in seconds')
+    parser.add_argument('--max-parallel', type=int, default=MAX_PARALLEL,
+                        help='hosts queried at the same time')
+    options = parser.parse_args(argv)
+
+    options.operation = ALIASES.get(options.operation, options.operation)
+    if options.operation not in operations():
+        parser.error(f"unknown operation {options.operation}")
+
+    try:
+        options.args = operation_arguments(options.operation, options.args)
+    except KeyError as error:
+        parser.error(f"unknown mode {error}")
+
+    config = configparser.ConfigParser()
+    config.read(options.config)
+
+    if options.host:
+        options.targets = [(host, options.passwd) for host in options.host]
+    elif not config.has_section('hosts'):
+        parser.error(f"no [hosts] in {options.config}")
+    elif options.hosts == 'all':
+        options.targets = list(config['hosts'].items())
+    else:
+        options.targets = [(host, config['hosts'].get(host))
+                           for host in options.hosts.split(',')]
+
+    options.config = config
+    return options
+
+
+def main(argv=None):
+    options = parse_args(sys.argv[1:] if argv is None else argv)
+    writer = Writer(sys.stdout, options.format)
+    failed = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, options.max_parallel)) as pool:
+        futures = {pool.submit(run, host, password, options.operation,
+                               options.args, options): host
+                   for host, password in options.targets}
+
+        for future in as_completed(futures):
+            try:
+                rows = future.result()
+            except Exception as error:
+                failed += 1
+                print(f"{futures[future]}: {error}", file=sys.stderr)
+                continue
+
+            try:
+                writer.write(rows)
+            except BrokenPipeError:
+                # e.g. piped to head, no point in waiting for other hosts
+                pool.shutdown(wait=False, cancel_futures=True)
+                # don't fail again flushing stdout at exit
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+                return 0
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -21,15 +21,15 @@
 # Based on client/boinc_cmd.cpp
 
 import rpc
+import sys
 import socket
 import hashlib
 import datetime
 import time
 import logging
-import configparser
 
+from collections import Counter
 from enum import IntEnum
-from multiprocessing.pool import INIT
 from functools import total_ordering
 from xml.etree import ElementTree
 
@@ -37,9 +37,24 @@ LOGGER = logging.getLogger('boinc-cluster')
 
 GUI_RPC_PASSWD_FILE = "/etc/boinc-client/gui_rpc_auth.cfg"
 
-config = configparser.ConfigParser()
+# Version announced to the core clients by exchange_versions()
+CLIENT_VERSION = "7.20.5"
 
-config.read('config.ini')
+
+def client_options(config):
+    ''' Return the BoincClient keyword arguments set in the [application]
+        section of config, a configparser.ConfigParser such as the one of
+        config.ini. Nothing is read from disk by this module, scripts pass
+        their settings explicitly.
+    '''
+    return {
+        'version': config.get('application', 'version',
+                              fallback=CLIENT_VERSION),
+        'pipeline': config.getboolean('application', 'rpc_pipelining',
+                                      fallback=False),
+        'reuse': config.getboolean('application', 'reuse_replies',
+                                   fallback=True)
+    }
 
 
 def setattrs_from_xml(obj, xml, attrfuncdict={}):
@@ -114,6 +129,13 @@ def parse_str(e, attr):
     return "" if e.text is None else e.text.strip()
 
 
+def parse_interned_str(e, attr):
+    ''' Helper to convert ElementTree.Element.text to an interned string,
+        for values repeated across many objects, such as project URLs
+    '''
+    return "" if e.text is None else sys.intern(e.text.strip())
+
+
 def parse_list(e, attr):
     ''' Helper to convert ElementTree.Element to list. For now, simply return
         the list of root element's children
@@ -318,13 +340,42 @@ class Process(IntEnum):
     # // waiting for async file copies to finish
 
 
+class MsgPriority(IntEnum):
+    ''' values of MESSAGE_DESC::priority '''
+    UNKNOWN = -1
+    INFO = 1
+    USER_ALERT = 2
+    INTERNAL_ERROR = 3
+
+    @classmethod
+    def name(cls, v):
+        name_hash = {
+            cls.INFO: "info",
+            cls.USER_ALERT: "alert",
+            cls.INTERNAL_ERROR: "internal error"
+        }
+
+        if v in name_hash:
+            return name_hash[v]
+        else:
+            return "unknown"
+
+
 class _Struct(object):
     ''' base helper class with common methods for all classes derived from
         BOINC's C++ structs
     '''
+    # String attributes parsed with parse_interned_str()
+    _interned = ()
+    _attrfuncdict = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._attrfuncdict = dict.fromkeys(cls._interned, parse_interned_str)
+
     @classmethod
     def parse(cls, xml):
-        return setattrs_from_xml(cls(), xml)
+        return setattrs_from_xml(cls(), xml, cls._attrfuncdict)
 
     def __str__(self, indent=0):
         buf = '%s%s:\n' % ('\t' * indent, self.__class__.__name__)
@@ -343,6 +394,47 @@ class _Struct(object):
                                          else repr(value))
         return buf
 
+    def as_dict(self):
+        ''' Return the attributes as a dict of plain, JSON serializable
+            values
+        '''
+        return {attr: plain_value(value) for attr, value in self.__dict__.items()}
+
+
+def same_value(value, other):
+    ''' Whether value and other, as parsed from replies, are equal. Unlike
+        comparing their plain_value(), nothing is built along the way.
+    '''
+    if value is other:
+        return True
+    if type(value) is not type(other):
+        return False
+    if isinstance(value, _Struct):
+        mine, theirs = value.__dict__, other.__dict__
+        # nested _Structs only compare equal by identity here
+        return mine == theirs or (mine.keys() == theirs.keys() and all(
+            same_value(item, theirs[attr]) for attr, item in mine.items()))
+    if isinstance(value, (list, tuple)):
+        return len(value) == len(other) and all(map(same_value, value, other))
+    if isinstance(value, ElementTree.Element):
+        return ElementTree.tostring(value) == ElementTree.tostring(other)
+    return value == other
+
+
+def plain_value(value):
+    ''' Return value with _Structs converted to dicts, XML replies to text
+        and datetimes to ISO 8601, recursively
+    '''
+    if isinstance(value, _Struct):
+        return value.as_dict()
+    if isinstance(value, (list, tuple)):
+        return [plain_value(v) for v in value]
+    if isinstance(value, ElementTree.Element):
+        return ElementTree.tostring(value, encoding='unicode')
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
 
 @total_ordering
 class VersionInfo(_Struct):
@@ -580,6 +672,8 @@ class ProjectListEntry(_Struct):
 
 
 class Project(_Struct):
+    _interned = ('master_url', 'project_name')
+
     def __init__(self):
         self.master_url = ""
         self.project_name = ""
@@ -702,6 +796,8 @@ class Statistics(_Struct):
 
 
 class ProjectStatistics(_Struct):
+    _interned = ('master_url',)
+
     def __init__(self):
         self.daily_statistics = []
         self.master_url = ""
@@ -774,12 +870,16 @@ class DiskUsageSummary(_Struct):
 
 
 class DiskUsageProject(_Struct):
+    _interned = ('master_url',)
+
     def __init__(self):
         self.master_url = ""
         self.disk_usage = 0
 
 
 class FileTransfer(_Struct):
+    _interned = ('project_url', 'project_name')
+
     def __init__(self):
         self.project_url = ""
         self.project_name = ""
@@ -794,6 +894,8 @@ class FileTransfer(_Struct):
         self.project_backoff = 0.0
         self.project = None
         self.persistent_file_xfer = None
+        self.file_xfer = None
+        self.xfer_active = False
 
     @classmethod
     def parse(cls, xml):
@@ -802,6 +904,13 @@ class FileTransfer(_Struct):
 
         file_transfer = super(FileTransfer, cls).parse(xml)
 
+        # bytes_xferred, file_offset and xfer_speed are only sent, in
+        # <file_xfer>, while the transfer is in progress
+        if file_transfer.file_xfer is not None:
+            setattrs_from_xml(file_transfer, file_transfer.file_xfer)
+            file_transfer.xfer_active = True
+            file_transfer.file_xfer = None
+
         persistent_file_xfer = PersistentFileXFer.parse(
             file_transfer.persistent_file_xfer)
 
@@ -826,6 +935,8 @@ class PersistentFileXFer(_Struct):
 
 
 class OldResult(_Struct):
+    _interned = ('project_url', 'app_name')
+
     def __init__(self):
         self.project_url = ""
         self.result_name = ""
@@ -838,9 +949,42 @@ class OldResult(_Struct):
         self.create_time = 0.0
 
 
+class Message(_Struct):
+    ''' An event log message. seqno starts over when the core client does '''
+    _interned = ('project',)
+
+    def __init__(self):
+        self.project = ""
+        self.pri = 0
+        self.seqno = 0
+        self.body = ""
+        self.time = 0.0
+
+
+class Notice(_Struct):
+    ''' A notice. A reply starting with one of seqno -1 means the client
+        dropped some, and the notices that follow are all of them
+    '''
+    _interned = ('project_name', 'category')
+
+    def __init__(self):
+        self.seqno = 0
+        self.title = ""
+        self.description = ""
+        self.create_time = 0.0
+        self.arrival_time = 0.0
+        self.is_private = False
+        self.project_name = ""
+        self.category = ""
+        self.link = ""
+
+
 class Result(_Struct):
     ''' Also called "task" in some contexts '''
 
+    _interned = ('project_url', 'plan_class', 'resources',
+                 'scheduler_wait_reason')
+
     def __init__(self):
         # Names and values follow lib/gui_rpc_client.h @ RESULT
         # Order too, except when grouping contradicts client/result.cpp
@@ -963,6 +1107,8 @@ class Result(_Struct):
 
 
 class WorkUnit(_Struct):
+    _interned = ('app_name',)
+
     def __init__(self) -> None:
 
         self.name = ""
@@ -993,6 +1139,8 @@ class WorkUnit(_Struct):
 
 
 class App(_Struct):
+    _interned = ('name', 'user_friendly_name')
+
     def __init__(self):
 
         self.name = ""
@@ -1014,6 +1162,8 @@ class ProejctAttachReply(_Struct):
 
 
 class AppVersion(_Struct):
+    _interned = ('app_name', 'platform', 'plan_class', 'api_version')
+
     def __init__(self):
 
         self.app_name = ""
@@ -1040,7 +1190,35 @@ class AppVersion(_Struct):
         return appVersion
 
 
+class StateDiff(_Struct):
+    ''' Items added, removed and changed from a CCState to the next one, by
+        CCState list name, see CCState.diff()
+    '''
+
+    def __init__(self):
+
+        self.added = {}  # new items
+        self.removed = {}  # keys of the items that are gone
+        self.changed = {}  # new values of the items that differ
+
+    def __bool__(self):
+        return any(items for changes in (self.added, self.removed, self.changed)
+                   for items in changes.values())
+
+
 class CCState(_Struct):
+    # Key of the items of each list, for diff()
+    _keys = {
+        'projects': lambda project: project.master_url,
+        'apps': lambda app: app.name,
+        'app_versions': lambda appVersion: (appVersion.app_name,
+                                            appVersion.version_num,
+                                            appVersion.platform,
+                                            appVersion.plan_class),
+        'work_units': lambda workUnit: workUnit.name,
+        'results': lambda result: result.name
+    }
+
     def __init__(self):
 
         self.host_info = None
@@ -1087,21 +1265,71 @@ class CCState(_Struct):
 
         return clientState
 
+    def diff(self, previous):
+        ''' Return the StateDiff from previous, an older CCState of the same
+            host or None, to this one. Items are matched by key and compared
+            by value. This method is not part of the original API.
+        '''
+        diff = StateDiff()
+        if previous is self:
+            # a reply reused as is, see BoincClient
+            for changes in (diff.added, diff.removed, diff.changed):
+                changes.update((name, []) for name in self._keys)
+            return diff
+
+        for name, key in self._keys.items():
+            old = {}
+            if previous is not None:
+                old = {key(item): item for item in getattr(previous, name)}
+
+            added = []
+            changed = []
+            for item in getattr(self, name):
+                before = old.pop(key(item), None)
+                if before is None:
+                    added.append(item)
+                elif not same_value(before, item):
+                    changed.append(item)
+
+            diff.added[name] = added
+            diff.removed[name] = list(old)
+            diff.changed[name] = changed
+
+        return diff
+
 
 class BoincClient(object):
 
-    def __init__(self, host="", passwd=None):
+    def __init__(self, host="", passwd=None, version=CLIENT_VERSION,
+                 pipeline=False, timeout=0, reuse=False):
         host = host.split(':', 1)
 
         self.hostname = host[0]
         self.port = int(host[1]) if len(host) == 2 else 31416
         self.passwd = passwd
         self.rpc = rpc.Rpc(text_output=False)
-        self.version = None
+        # Socket timeout in seconds, rpc.GUI_RPC_TIMEOUT if 0
+        self.timeout = timeout
+        # Ours, announced by exchange_versions(). self.version becomes the
+        # one of the core client once connected
+        self.client_version = version
+        self.version = version
         self.authorized = False
 
-        if 'version' in config['application']:
-            self.version = config['application']['version']
+        # Pipelining is opt-in, see rpc.Rpc.call_many()
+        self.pipeline = pipeline
+
+        # With reuse, a reply byte-identical to the previous one of the same
+        # request returns the object parsed from that one, as is. Callers
+        # then share those objects, and must not change them in ways the
+        # next call wouldn't expect.
+        self.reuse = reuse
+        # (digest, parsed object) of the last reply to each request text
+        # whose digest rpc still keeps
+        self.replies = {}
+        # Replies parsed and reused, by RPC_CALLS name
+        self.parsed = Counter()
+        self.reused = Counter()
 
         # Informative, not authoritative. Records status of *last* RPC call,
         # but does not infer success about the *next* one.
@@ -1112,17 +1340,20 @@ class BoincClient(object):
     def __exit__(self, *args): self.disconnect()
 
     def connect(self):
-        try:
-            self.rpc.connect(self.hostname, self.port)
-            self.connected = True
-        except socket.error:
-            self.connected = False
-
-            LOGGER.error(
-                f"Socket error, {self.hostname} client connectioned failed")
-            return
-        self.authorized = self.authorize(self.passwd)
-        self.version = self.exchange_versions(f'BOINC Cluster {self.version}')
+        # threads sharing this client must not interleave their handshakes
+        with self.rpc.lock:
+            try:
+                self.rpc.connect(self.hostname, self.port, self.timeout)
+                self.connected = True
+            except socket.error:
+                self.connected = False
+
+                LOGGER.error(
+                    f"Socket error, {self.hostname} client connectioned failed")
+                return
+            self.authorized = self.authorize(self.passwd)
+            self.version = self.exchange_versions(
+                f'BOINC Cluster {self.client_version}')
 
     def disconnect(self):
         LOGGER.debug(f"{self.hostname} client disconnected...")
@@ -1155,7 +1386,7 @@ class BoincClient(object):
 
     def exchange_versions(self, name):
         ''' Return VersionInfo instance with core client version info '''
-        version_parts = self.version.split('.')
+        version_parts = self.client_version.split('.')
         LOGGER.debug(f'version_parts: {version_parts}')
         return VersionInfo.parse(self.rpc.call("<exchange_versions>\n"
                                                f"   <major>{version_parts[0]}</major>\n"
@@ -1165,7 +1396,7 @@ class BoincClient(object):
                                                "</exchange_versions>\n"))
 
     def get_state(self):
-        return CCState.parse(self.rpc.call('<get_state/>'))
+        return self.call('get_state')
 
     def get_results(self, active_only=False):
         ''' Get a list of results.
@@ -1174,88 +1405,42 @@ class BoincClient(object):
             Use CC_STATE::lookup_result() to find this result in the current static state;
             if it's not there, call get_state() again.
         '''
-        reply = self.rpc.call("<get_results><active_only>%d</active_only></get_results>"
-                              % (1 if active_only else 0))
-        if not reply.tag == 'results':
-            return []
-
-        results = []
-        for item in list(reply):
-            results.append(Result.parse(item))
-
-        return results
+        return self.call('get_results', active_only)
 
     def get_old_results(self):
-        reply = self.rpc.call("<get_old_results/>")
-
-        if not reply.tag == "old_results":
-            return []
-
-        old_results = []
-
-        for item in list(reply):
-            old_results.append(OldResult.parse(item))
-
-        return old_results
+        return self.call('get_old_results')
 
     def get_file_transfers(self):
-        transfers_xml = self.rpc.call("<get_file_transfers/>")
-
-        LOGGER.debug(f"Transfers XML: {transfers_xml}")
-
-        if not transfers_xml.tag == 'file_transfers':
-            return []
-
-        transfers = []
-
-        for transfer in list(transfers_xml):
-            transfers.append(FileTransfer.parse(transfer))
-
-        return transfers
+        return self.call('get_file_transfers')
 
     def get_simple_gui_info(self):
-        reply = self.rpc.call("<get_simple_gui_info/>")
-
-        projects = []
-        results = []
-
-        for item in list(reply):
-            if item.tag == "project":
-                projects.append(Project.parse(item))
-            elif item.tag == "result":
-                results.append(Result.parse(item))
-
-        return (projects, results)
+        return self.call('get_simple_gui_info')
 
     def get_project_status(self):
-        reply = self.rpc.call("<get_project_status/>")
-
-        if not reply or not reply.tag == 'projects':
-            return []
-
-        projects = []
-        for item in list(reply):
-            projects.append(Project.parse(item))
-
-        return projects
+        return self.call('get_project_status')
 
     def get_all_project_list(self):
-        reply = self.rpc.call("<get_all_projects_list/>")
+        return self.call('get_all_projects_list')
 
-        if not reply or not reply.tag == 'projects':
-            return []
+    def get_disk_usage(self):
+        return self.call('get_disk_usage')
 
-        projects = []
-        for item in list(reply):
-            projects.append(ProjectListEntry.parse(item))
+    def get_statistics(self):
+        return self.call('get_statistics')
 
-        return projects
+    def get_message_count(self):
+        ''' Return the seqno of the last message of the event log '''
+        return self.call('get_message_count')
 
-    def get_disk_usage(self):
-        return DiskUsageSummary.parse(self.rpc.call('<get_disk_usage/>'))
+    def get_messages(self, seqno=0):
+        ''' Return the list of the Messages with a seqno over seqno '''
+        return self.call('get_messages', seqno)
 
-    def get_statistics(self):
-        return Statistics.parse(self.rpc.call('<get_statistics/>'))
+    def get_notices(self, seqno=0):
+        ''' Return the list of the Notices with a seqno over seqno,
+            including private ones (which requires authorization)
+        '''
+        return self.call('get_notices', seqno)
 
     def get_cc_status(self):
         ''' Return CCStatus instance containing basic status, such as
@@ -1266,13 +1451,98 @@ class BoincClient(object):
                 f"Not connected, {self.hostname} client connection attempt...")
             self.connect()
         try:
-            return CCStatus.parse(self.rpc.call('<get_cc_status/>'))
+            return self.call('get_cc_status')
         except socket.error as error:
             self.connected = False
 
             LOGGER.error(
                 f"Socket error, {self.hostname} client connectioned failed")
 
+    def call(self, name, *args):
+        ''' Do a single read-only RPC call from RPC_CALLS and return the
+            parsed reply. This method is not part of the original API.
+        '''
+        return self.call_parsed([(name,) + args])[0]
+
+    def call_parsed(self, calls, pipeline=False):
+        ''' Do the (name, arg, ...) RPC_CALLS calls and return the list of
+            their parsed replies, in order. This method is not part of the
+            original API.
+        '''
+        requests = []
+        for call in calls:
+            request, parse = RPC_CALLS[call[0]]
+            requests.append((call[0], request(*call[1:]), parse))
+
+        # digests and cached replies must stay in step with other threads
+        with self.rpc.lock:
+            known = {}
+            if self.reuse:
+                known = {request: self.replies[request][0]
+                         for name, request, parse in requests
+                         if request in self.replies}
+
+            replies = self.rpc.call_many([request for name, request, parse
+                                          in requests],
+                                         pipeline=pipeline, known=known)
+
+            results = []
+            for (name, request, parse), reply in zip(requests, replies):
+                if name in SEQUENCED_CALLS:
+                    # a new request text every time, nothing to reuse
+                    self.rpc.digests.pop(request, None)
+                elif reply is rpc.UNCHANGED:
+                    self.reused[name] += 1
+                    results.append(self.replies[request][1])
+                    continue
+
+                result = parse(reply)
+                self.parsed[name] += 1
+                if self.reuse and name not in SEQUENCED_CALLS:
+                    self.replies[request] = (self.rpc.digests[request], result)
+                results.append(result)
+
+            # only the replies of requests rpc keeps a digest of, so both
+            # stay bounded
+            if len(self.replies) > len(self.rpc.digests):
+                for request in [request for request in self.replies
+                                if request not in self.rpc.digests]:
+                    del self.replies[request]
+
+            return results
+
+    def reply_digest(self, name, *args):
+        ''' Return the digest of the last raw reply to the RPC_CALLS call
+            name(*args), or None if it wasn't made yet. Equal digests mean
+            byte-identical replies. This method is not part of the original
+            API.
+        '''
+        request, parse = RPC_CALLS[name]
+        return self.rpc.digests.get(request(*args))
+
+    def batch(self, calls):
+        ''' Do several read-only RPC calls in one go and return the list of
+            parsed replies, in order. Each call is either a name from
+            RPC_CALLS or a (name, arg, ...) tuple, for example:
+                status, projects, tasks = bc.batch(['get_cc_status',
+                                                    'get_project_status',
+                                                    ('get_results', False)])
+            Requests are pipelined over the connection when self.pipeline
+            is set, otherwise they are sent one at a time.
+            This method is not part of the original API.
+        '''
+        if not self.connected:
+            self.connect()
+
+        calls = [(call,) if isinstance(call, str) else call for call in calls]
+
+        try:
+            return self.call_parsed(calls, pipeline=self.pipeline)
+        except socket.error:
+            self.connected = False
+            self.rpc.disconnect()
+            raise
+
     def network_available(self):
         return self.rpc.call("<network_available/>")
 
@@ -1371,21 +1641,11 @@ class BoincClient(object):
 
     def get_screensaver_tasks(self):
         ''' Get Screensaver Tasks.'''
-        reply = self.rpc.call("<get_screensaver_tasks/>")
-
-        if not reply or not reply.tag == "get_screensaver_tasks":
-            return []
-
-        tasks = []
-
-        for task in list(reply):
-            tasks.append(Result.parse(task))
-
-        return tasks
+        return self.call('get_screensaver_tasks')
 
     def get_host_info(self):
         ''' Get information about host hardware and usage. '''
-        return HostInfo.parse(self.rpc.call('<get_host_info/>'))
+        return self.call('get_host_info')
 
     def get_tasks(self):
         ''' Same as get_results(active_only=False) '''
@@ -1419,6 +1679,79 @@ class BoincClient(object):
         return False
 
 
+def parse_list_reply(tag, parse):
+    ''' Return a reply parser that builds a list by parsing each child of a
+        reply whose root is tag, or an empty list for any other reply
+    '''
+    def parser(reply):
+        if reply is None or not reply.tag == tag:
+            return []
+        return [parse(item) for item in list(reply)]
+    return parser
+
+
+def parse_seqno(reply):
+    if reply is None or not reply.tag == 'seqno':
+        return 0
+    return parse_int(reply, 0)
+
+
+def parse_simple_gui_info(reply):
+    projects = []
+    results = []
+
+    for item in list(reply):
+        if item.tag == "project":
+            projects.append(Project.parse(item))
+        elif item.tag == "result":
+            results.append(Result.parse(item))
+
+    return (projects, results)
+
+
+# Read-only calls as name: (request builder, reply parser). Names match the
+# BoincClient methods, which are thin wrappers around these so the very same
+# requests can be issued in a batch.
+RPC_CALLS = {
+    'get_state': (lambda: '<get_state/>', CCState.parse),
+    'get_results': (lambda active_only=False:
+                    "<get_results><active_only>%d</active_only></get_results>"
+                    % (1 if active_only else 0),
+                    parse_list_reply('results', Result.parse)),
+    'get_old_results': (lambda: '<get_old_results/>',
+                        parse_list_reply('old_results', OldResult.parse)),
+    'get_file_transfers': (lambda: '<get_file_transfers/>',
+                           parse_list_reply('file_transfers',
+                                            FileTransfer.parse)),
+    'get_simple_gui_info': (lambda: '<get_simple_gui_info/>',
+                            parse_simple_gui_info),
+    'get_project_status': (lambda: '<get_project_status/>',
+                           parse_list_reply('projects', Project.parse)),
+    'get_all_projects_list': (lambda: '<get_all_projects_list/>',
+                              parse_list_reply('projects',
+                                               ProjectListEntry.parse)),
+    'get_disk_usage': (lambda: '<get_disk_usage/>', DiskUsageSummary.parse),
+    'get_statistics': (lambda: '<get_statistics/>', Statistics.parse),
+    'get_cc_status': (lambda: '<get_cc_status/>', CCStatus.parse),
+    'get_host_info': (lambda: '<get_host_info/>', HostInfo.parse),
+    'get_message_count': (lambda: '<get_message_count/>', parse_seqno),
+    'get_messages': (lambda seqno=0:
+                     "<get_messages><seqno>%d</seqno></get_messages>" % seqno,
+                     parse_list_reply('msgs', Message.parse)),
+    'get_notices': (lambda seqno=0:
+                    "<get_notices><seqno>%d</seqno></get_notices>" % seqno,
+                    parse_list_reply('notices', Notice.parse)),
+    'get_screensaver_tasks': (lambda: '<get_screensaver_tasks/>',
+                              parse_list_reply('get_screensaver_tasks',
+                                               Result.parse)),
+}
+RPC_CALLS['get_tasks'] = RPC_CALLS['get_results']
+
+# Calls whose requests carry the seqno of the last entry already fetched, so
+# their request texts keep changing: their replies aren't remembered
+SEQUENCED_CALLS = ('get_messages', 'get_notices')
+
+
 def read_gui_rpc_password():
     ''' Read password string from GUI_RPC_PASSWD_FILE file, trim the last CR
         (if any), and return it
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# collector.py - Collector process for the production setup
+#
+#    Copyright (C) 2020 Jonathan Drake (drakej) <952345+drakej@users.noreply.github.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+# In production a single collector process owns the BOINC connections and
+# runs the update functions of boinccluster on their own cadence. Every time
+# a cycle publishes new data, the current snapshot.Snapshot is pickled once and
+# pushed over a local socket to each subscribed web worker, which installs it
+# and serves requests from it without doing any RPC of its own. Over the
+# same connection, workers ask the collector to do the host operations users
+# request (boinccluster.HOST_COMMANDS, changing run modes for instance) and
+# to force a refresh of some datasets after. Those requests are JSON
+# objects, the collector never unpickles anything. Both ends authenticate
+# each other with the [collector] authkey before anything is exchanged, and
+# refuse to start without one.
+#
+# Usage: python3 collector.py (see production-run.sh)
+
+import json
+import pickle
+import threading
+import time
+import logging
+
+from multiprocessing.connection import Listener, Client, wait, AuthenticationError
+
+LOGGER = logging.getLogger('boinc-cluster')
+
+COLLECTOR_ADDRESS = '127.0.0.1:31417'
+
+# Seconds between checks for due datasets
+TICK = 1.0
+
+# Seconds between attempts of a web worker to reach the collector
+RETRY = 5.0
+
+# Bytes of a request, at most
+MAX_REQUEST = 4096
+
+
+def address(config):
+    ''' Return the [collector] address of config as a multiprocessing
+        address: (host, port) for 'host:port', a Unix socket path otherwise
+    '''
+    value = config.get('collector', 'address', fallback=COLLECTOR_ADDRESS)
+    if ':' in value and not value.startswith('/'):
+        host, port = value.rsplit(':', 1)
+        return (host, int(port))
+    return value
+
+
+def authkey(config):
+    ''' Return the [collector] authkey of config. Both ends unpickle what
+        the other sends, so running without a real key is refused.
+    '''
+    value = config.get('collector', 'authkey', fallback='').strip()
+    if not value or (value.startswith('<') and value.endswith('>')):
+        raise ValueError("[collector] authkey must be set to a random secret, "
+                         "e.g. the output of: python3 -c 'import secrets; "
+                         "print(secrets.token_hex(32))'")
+    return value.encode('utf-8')
+
+
+class Publisher(object):
+    ''' Collector end: accepts web workers and pushes them each new snapshot '''
+
+    def __init__(self, address, authkey):
+        if not authkey:
+            raise ValueError("The collector needs an authkey")
+        self.listener = Listener(address, authkey=authkey)
+        self.connections = []
+        self.lock = threading.Lock()
+        self.data = None
+
+        thread = threading.Thread(target=self.accept, daemon=True)
+        thread.start()
+
+    def accept(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except (OSError, EOFError, AuthenticationError) as error:
+                LOGGER.info(f"Collector rejected a subscriber: {error}")
+                continue
+
+            with self.lock:
+                # bring the newcomer up to date right away
+                if self.data is not None:
+                    try:
+                        conn.send_bytes(self.data)
+                    except OSError:
+                        continue
+                self.connections.append(conn)
+
+            LOGGER.info(f"Collector has {len(self.connections)} subscribers")
+
+    def publish(self, state):
+        ''' Send state to every subscriber, pickling it only once '''
+        data = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+
+        with self.lock:
+            self.data = data
+            for conn in list(self.connections):
+                try:
+                    conn.send_bytes(data)
+                except OSError:
+                    self.drop(conn)
+
+    def requests(self, timeout):
+        ''' Wait up to timeout seconds for requests of the subscribers, and
+            return the set of dataset names to refresh and the list of the
+            (host, command name, list of arguments) to do, in order
+        '''
+        with self.lock:
+            connections = list(self.connections)
+
+        names = set()
+        commands = []
+        if not connections:
+            time.sleep(timeout)
+            return names, commands
+
+        for conn in wait(connections, timeout):
+            try:
+                requested = json.loads(conn.recv_bytes(MAX_REQUEST))
+            except (EOFError, OSError, ValueError):
+                with self.lock:
+                    self.drop(conn)
+                continue
+            if not isinstance(requested, dict):
+                continue
+
+            refresh = requested.get('refresh')
+            if isinstance(refresh, list):
+                names.update(name for name in refresh
+                             if isinstance(name, str))
+            command = requested.get('command')
+            if (isinstance(command, str)
+                    and isinstance(requested.get('host'), str)
+                    and isinstance(requested.get('args'), list)):
+                commands.append((requested['host'], command,
+                                 requested['args']))
+        return names, commands
+
+    def drop(self, conn):
+        # caller holds self.lock
+        if conn in self.connections:
+            self.connections.remove(conn)
+        conn.close()
+
+
+class Subscriber(object):
+    ''' Web worker end: receives the snapshots published by the collector in a
+        background thread and hands them to install()
+    '''
+
+    def __init__(self, address, authkey, install):
+        if not authkey:
+            raise ValueError("Subscribing to the collector needs an authkey")
+        self.address = address
+        self.authkey = authkey
+        self.install = install
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+
+    def run(self):
+        while True:
+            try:
+                self.conn = Client(self.address, authkey=self.authkey)
+                LOGGER.info(f"Subscribed to collector at {self.address}")
+                while True:
+                    self.install(pickle.loads(self.conn.recv_bytes()))
+            except (OSError, EOFError, AuthenticationError) as error:
+                LOGGER.info(f"Collector at {self.address} unavailable: {error}")
+                self.conn = None
+            time.sleep(RETRY)
+
+    def request(self, names):
+        ''' Ask the collector for a forced refresh of the named datasets '''
+        self.send({'refresh': list(names)})
+
+    def command(self, host, name, args):
+        ''' Ask the collector to do the command name with args on host '''
+        self.send({'command': name, 'host': host, 'args': list(args)})
+
+    def send(self, message):
+        conn = self.conn
+        if conn is None:
+            LOGGER.info(f"Collector unavailable, dropped request {message}")
+            return
+        with self.lock:
+            try:
+                conn.send_bytes(json.dumps(message).encode('utf-8'))
+            except OSError as error:
+                LOGGER.info(f"Couldn't send request {message}: {error}")
+
+
+def main():
+    logging.basicConfig(
+        format='[%(asctime)s] %(levelname)s in %(module)s: %(message)s')
+
+    import boinccluster
+    import snapshot
+
+    config = boinccluster.config
+    publisher = Publisher(address(config), authkey(config))
+    LOGGER.info(f"Collector listening on {address(config)}")
+
+    # serve the last known state until the hosts answered
+    if boinccluster.restoreSnapshot():
+        publisher.publish(snapshot.current())
+
+    while True:
+        forced, commands = publisher.requests(TICK)
+
+        for host, name, args in commands:
+            try:
+                boinccluster.runCommand(host, name, args)
+            except (ValueError, TypeError, OSError) as error:
+                LOGGER.info(f"Collector couldn't do {name} on {host}: "
+                            f"{error}")
+
+        published = snapshot.current()
+        for name, update in boinccluster.UPDATERS.items():
+            # one failing dataset must not take the others down with it
+            try:
+                update(force=name in forced)
+            except Exception:
+                LOGGER.exception(f"Collector couldn't update {name}")
+
+        # every publication swaps in a new snapshot
+        if snapshot.current() is not published:
+            publisher.publish(snapshot.current())
+
+            reused, parsed = boinccluster.replyCounts()
+            LOGGER.debug(f"Reused {reused} of {reused + parsed} RPC replies")
+
+
+if __name__ == '__main__':
+    main()
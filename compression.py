@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# compression.py - HTTP response compression helpers
+#
+#    Copyright (C) 2020 Jonathan Drake (drakej) <952345+drakej@users.noreply.github.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Preferred first
+ENCODINGS = (['br'] if brotli else []) + ['gzip']
+
+
+def compressible(mimetype):
+    ''' Whether a response of mimetype is worth compressing. Images and
+        other binary formats are already compressed, or close to it. Event
+        streams must reach the browser as each event is written, which a
+        compressor holding data back would prevent.
+    '''
+    if mimetype == 'text/event-stream':
+        return False
+    return bool(mimetype) and (mimetype.startswith('text/')
+                               or mimetype.endswith(('json', 'javascript',
+                                                     'xml', 'ndjson')))
+
+
+def choose_encoding(accept_encodings):
+    ''' Return the best supported encoding in the Accept-Encoding header
+        (a werkzeug Accept object), or None for identity
+    '''
+    return accept_encodings.best_match(ENCODINGS)
+
+
+def compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def compress_stream(chunks, encoding):
+    ''' Compress an iterable of chunks (bytes or str) on the fly, yielding
+        compressed data as it becomes available so large or slow responses
+        never sit in memory as a whole. Each chunk is flushed, so what was
+        produced so far reaches the client without waiting for the next
+        one: producers should yield chunks worth sending on their own.
+    '''
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress_chunk, finish = compressor.process, compressor.finish
+
+        def flush():
+            return compressor.flush()
+    else:
+        # wbits=31 writes a gzip header and trailer around the deflate data
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        compress_chunk, finish = compressor.compress, compressor.flush
+
+        def flush():
+            return compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    for chunk in chunks:
+        if not chunk:
+            continue
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        yield compress_chunk(chunk) + flush()
+
+    yield finish()
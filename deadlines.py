@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# deadlines.py - Projected completion of the tasks against their deadlines
+#
+#    Copyright (C) 2020 Jonathan Drake (drakej) <952345+drakej@users.noreply.github.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+# The core client's own estimate of the time left of a task is often off,
+# and says nothing about tasks that barely progress because the host is
+# busy or throttled. Each time the task rows of a host are refreshed, the
+# progress of each running task since it was last seen to move gives its
+# actual rate, in fraction done per second of wall time. Tasks not seen
+# moving yet fall back to their progress per elapsed second, and tasks that
+# didn't start to the client's estimate. The projected completion time of
+# each task is then compared to its deadline.
+#
+# Projections are absolute times, so the assessment of a host only changes
+# when its rows do, and only the hosts that were polled are assessed again.
+
+import time
+
+# Seconds of slack under which a task is at risk of missing its deadline
+RISK_MARGIN = 3600
+
+# Task states in which a task progresses
+RUNNING_STATES = ('Running', 'Running (non-CPU-intensive)')
+
+
+class DeadlineEngine(object):
+    ''' Assesses the task rows of each host, remembering when each task was
+        last seen progressing
+    '''
+
+    def __init__(self, margin=RISK_MARGIN):
+        self.margin = margin
+        # (time, fraction done) when each task was last seen moving, by
+        # task name, by host
+        self.samples = {}
+
+    def assess(self, host, rows, now=None):
+        ''' Return the list of the risks of the unfinished task rows of host,
+            a {name: row} dict, most urgent first. Each risk is a dict of the
+            task name, project, state and deadline, its projected
+            completion time (None if it doesn't progress), slack in seconds
+            and whether it's at risk or already late.
+        '''
+        now = time.time() if now is None else now
+        previous = self.samples.get(host, {})
+        # tasks that are gone are forgotten
+        samples = self.samples[host] = {}
+        risks = []
+
+        for name, row in rows.items():
+            fraction = row['percent'] / 100
+            if fraction >= 1:
+                continue
+
+            sample = previous.get(name)
+            running = row['state'] in RUNNING_STATES
+            rate = 0.0
+
+            if sample is not None and fraction > sample[1] and now > sample[0]:
+                # moved since last seen: wall time rate, sampling again
+                rate = (fraction - sample[1]) / (now - sample[0])
+                sample = (now, fraction)
+            elif sample is None or fraction < sample[1]:
+                sample = (now, fraction)
+
+            if not rate and fraction and row['elapsedSeconds']:
+                rate = fraction / row['elapsedSeconds']
+            samples[name] = sample
+
+            deadline = row['deadline'] / 1000
+            if rate:
+                projected = now + (1 - fraction) / rate
+            elif not fraction:
+                projected = now + row['remainingSeconds']
+            else:
+                projected = None
+
+            slack = None if projected is None else deadline - projected
+            risks.append({
+                'host': host,
+                'name': name,
+                'projectName': row['projectName'],
+                'state': row['state'],
+                'running': running,
+                'percent': row['percent'],
+                'deadline': deadline,
+                'projected': projected,
+                'slack': slack,
+                'late': slack is not None and slack < 0,
+                'atRisk': slack is None or slack < self.margin
+            })
+
+        risks.sort(key=urgency)
+        return risks
+
+
+def urgency(risk):
+    ''' Sort key of risks: the least slack first, those without projection
+        before all others
+    '''
+    return float('-inf') if risk['slack'] is None else risk['slack']
+
+
+def ranked(risksByHost, limit=None):
+    ''' Return the at-risk tasks of all hosts, most urgent first, and the
+        summary of each host as {host: {tasks, atRisk, late, worstSlack}},
+        from a {host: risks} dict of DeadlineEngine.assess() lists
+    '''
+    tasks = []
+    hosts = {}
+    for host, risks in risksByHost.items():
+        atRisk = [risk for risk in risks if risk['atRisk']]
+        tasks.extend(atRisk)
+        slacks = [risk['slack'] for risk in risks if risk['slack'] is not None]
+        hosts[host] = {
+            'tasks': len(risks),
+            'atRisk': len(atRisk),
+            'late': sum(1 for risk in risks if risk['late']),
+            'worstSlack': min(slacks) if slacks else None
+        }
+
+    tasks.sort(key=urgency)
+    return tasks[:limit], hosts
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# diskusage.py - Disk usage history and trends of the cluster
+#
+#    Copyright (C) 2020 Jonathan Drake (drakej) <952345+drakej@users.noreply.github.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+# Each disk usage poll of a host adds a (time, used by BOINC, available to
+# BOINC, free) sample to its series, at most one every SAMPLE_INTERVAL
+# seconds and MAX_SAMPLES of them, about a day. The least squares line of
+# the space available to BOINC over the last TREND_WINDOW seconds gives how
+# fast it shrinks, and so when it runs out at that pace.
+
+from collections import OrderedDict
+
+SAMPLE_INTERVAL = 300
+MAX_SAMPLES = 288
+TREND_WINDOW = 6 * 3600
+
+# Fields of a sample
+SAMPLE_FIELDS = ('time', 'boinc', 'available', 'free')
+
+
+def sample(now, usage):
+    ''' Return the sample of a usage dict of updateDiskUsage() '''
+    return (now, usage['boinc'], usage['available'], usage['free'])
+
+
+def add_sample(samples, new, interval=SAMPLE_INTERVAL, limit=MAX_SAMPLES):
+    ''' Return the tuple samples with new appended, unless the last sample
+        is less than interval seconds older, keeping the last limit ones
+    '''
+    if samples and new[0] - samples[-1][0] < interval:
+        return samples
+    return (samples + (new,))[-limit:]
+
+
+def linear_fit(points):
+    ''' Return the (slope, intercept) of the least squares line through the
+        (x, y) points, or None if there are fewer than two distinct x
+    '''
+    count = len(points)
+    if count < 2:
+        return None
+
+    meanX = sum(x for x, y in points) / count
+    meanY = sum(y for x, y in points) / count
+    varianceX = sum((x - meanX) ** 2 for x, y in points)
+    if not varianceX:
+        return None
+
+    slope = sum((x - meanX) * (y - meanY) for x, y in points) / varianceX
+    return slope, meanY - slope * meanX
+
+
+def trend(samples, window=TREND_WINDOW):
+    ''' Return (bytes per second the space available to BOINC changes by,
+        seconds until it runs out) over the samples of the last window
+        seconds. Either is None when unknown, the time to full also when
+        the space doesn't shrink.
+    '''
+    if not samples:
+        return None, None
+
+    last = samples[-1]
+    fit = linear_fit([(time, available) for time, boinc, available, free
+                      in samples if time >= last[0] - window])
+    if fit is None:
+        return None, None
+
+    slope = fit[0]
+    if slope >= 0:
+        return slope, None
+    return slope, max(last[2], 0) / -slope
+
+
+def by_project(diskUsageMap, projectMap):
+    ''' Return the disk usage of each project summed over the hosts, as
+        a list of {url, name, bytes, hosts} dicts, largest first
+    '''
+    projects = OrderedDict()
+    for host, usage in diskUsageMap.items():
+        for project in usage['projects']:
+            total = projects.get(project.master_url)
+            if total is None:
+                known = projectMap.get(project.master_url)
+                total = projects[project.master_url] = {
+                    'url': project.master_url,
+                    'name': known.project_name if known else project.master_url,
+                    'bytes': 0,
+                    'hosts': 0
+                }
+            total['bytes'] += project.disk_usage
+            total['hosts'] += 1
+
+    return sorted(projects.values(), key=lambda total: -total['bytes'])
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# eventlog.py - Store of the event log messages and notices of the cluster
+#
+#    Copyright (C) 2020 Jonathan Drake (drakej) <952345+drakej@users.noreply.github.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+# Core clients number their event log messages and notices, and only send
+# those after a given seqno. Each poll fetches the ones newer than the last
+# stored for the host, so a chatty host costs its new messages only. They
+# are kept in a SQLite file for searching, and the last RING_SIZE of each
+# host in the snapshot, as plain dicts, for the latest ones.
+#
+# A core client that restarts numbers its messages from 1 again. Its message
+# count then being under the last stored seqno, the next poll starts over
+# from 0; rows are keyed by their time too so the new messages don't clash
+# with the old ones.
+#
+# Searches match text anywhere in the messages, so an index on the columns
+# is of no help. When SQLite has FTS5 with its trigram tokenizer (3.34 and
+# later), message_fts and notice_fts index every three characters of them,
+# kept up to date by triggers as rows are added. Text under three
+# characters, or an SQLite without them, falls back to scanning with LIKE.
+
+import heapq
+import sqlite3
+import threading
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS message (
+    host TEXT NOT NULL,
+    seqno INTEGER NOT NULL,
+    time REAL NOT NULL,
+    project TEXT NOT NULL,
+    pri INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    PRIMARY KEY (host, seqno, time)
+);
+CREATE INDEX IF NOT EXISTS message_time ON message (time);
+CREATE INDEX IF NOT EXISTS message_host ON message (host, time);
+CREATE INDEX IF NOT EXISTS message_project ON message (project, time);
+CREATE TABLE IF NOT EXISTS notice (
+    host TEXT NOT NULL,
+    seqno INTEGER NOT NULL,
+    create_time REAL NOT NULL,
+    arrival_time REAL NOT NULL,
+    project_name TEXT NOT NULL,
+    category TEXT NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    link TEXT NOT NULL,
+    PRIMARY KEY (host, create_time, title)
+);
+CREATE INDEX IF NOT EXISTS notice_time ON notice (create_time);
+'''
+
+# Full text indexes of the tables above, see matching()
+FTS_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5 (
+    body, content='message', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS message_fts_insert AFTER INSERT ON message BEGIN
+    INSERT INTO message_fts (rowid, body) VALUES (new.rowid, new.body);
+END;
+CREATE VIRTUAL TABLE IF NOT EXISTS notice_fts USING fts5 (
+    title, description, content='notice', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS notice_fts_insert AFTER INSERT ON notice BEGIN
+    INSERT INTO notice_fts (rowid, title, description)
+        VALUES (new.rowid, new.title, new.description);
+END;
+'''
+
+# Indexes the rows of a file written before the indexes were
+FTS_REBUILD = '''
+INSERT INTO message_fts (message_fts) VALUES ('rebuild');
+INSERT INTO notice_fts (notice_fts) VALUES ('rebuild');
+'''
+
+# Shortest text the trigram indexes can match
+FTS_MIN_LENGTH = 3
+
+MESSAGE_FIELDS = ('host', 'seqno', 'time', 'project', 'pri', 'body')
+NOTICE_FIELDS = ('host', 'seqno', 'create_time', 'arrival_time',
+                 'project_name', 'category', 'title', 'description', 'link')
+
+# Fields messages can be filtered on, by exact value
+MESSAGE_FILTERS = ('host', 'project', 'pri')
+
+# Latest messages and notices kept per host
+RING_SIZE = 500
+
+
+def message_record(host, message):
+    return {'host': host, 'seqno': message.seqno, 'time': message.time,
+            'project': message.project, 'pri': message.pri,
+            'body': message.body}
+
+
+def notice_record(host, notice):
+    return {'host': host, 'seqno': notice.seqno,
+            'create_time': notice.create_time,
+            'arrival_time': notice.arrival_time,
+            'project_name': notice.project_name, 'category': notice.category,
+            'title': notice.title, 'description': notice.description,
+            'link': notice.link}
+
+
+def append(ring, records, limit=RING_SIZE):
+    ''' Return the tuple ring with records appended, keeping the last limit
+        ones
+    '''
+    return (ring + tuple(records))[-limit:]
+
+
+def latest(rings, limit, field='time', host=None):
+    ''' Return the limit records of the {host: ring} rings, or only of host,
+        with the highest field, then seqno, highest first
+    '''
+    if host:
+        rings = {host: rings.get(host, ())}
+    return heapq.nlargest(limit, (record for ring in rings.values()
+                                  for record in ring),
+                          key=lambda record: (record[field], record['seqno']))
+
+
+def like(text):
+    ''' Return the LIKE pattern of the strings containing text '''
+    return '%' + text.replace('\\', '\\\\').replace('%', '\\%') \
+        .replace('_', '\\_') + '%'
+
+
+def phrase(text):
+    ''' Return the FTS5 query matching text as is '''
+    return '"' + text.replace('"', '""') + '"'
+
+
+class EventLog(object):
+    ''' SQLite file of the messages and notices of every host. The collector
+        adds them, web workers only search them.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        # last (message seqno, notice seqno) stored, by host
+        self.seqnos = None
+        # whether the schema was created, and the full text indexes are
+        # available, once connect()ed
+        self.created = False
+        self.fts = False
+        self.lock = threading.Lock()
+        self.schemaLock = threading.Lock()
+
+    def connect(self):
+        db = sqlite3.connect(self.path)
+        with self.schemaLock:
+            if not self.created:
+                self.create(db)
+                self.created = True
+        return db
+
+    def create(self, db):
+        # readers in other processes don't block the collector
+        db.execute('PRAGMA journal_mode=WAL')
+        db.executescript(SCHEMA)
+
+        indexed = db.execute("SELECT 1 FROM sqlite_master "
+                             "WHERE name = 'message_fts'").fetchone()
+        try:
+            db.executescript('BEGIN;' + FTS_SCHEMA
+                             + ('' if indexed else FTS_REBUILD) + 'COMMIT;')
+        except sqlite3.OperationalError:
+            # no FTS5, or no trigram tokenizer, in this SQLite
+            db.rollback()
+        else:
+            self.fts = True
+
+    def query(self, sql, params=()):
+        db = self.connect()
+        try:
+            return db.execute(sql, params).fetchall()
+        finally:
+            db.close()
+
+    def since(self, host):
+        ''' Return the (message seqno, notice seqno) to fetch host's new
+            messages and notices after
+        '''
+        with self.lock:
+            if self.seqnos is None:
+                # the newest rows are those of the current numbering
+                self.seqnos = {}
+                for column, table, order in ((0, 'message', 'time'),
+                                             (1, 'notice', 'arrival_time')):
+                    for host_, seqno in self.query(
+                            'SELECT host, seqno FROM (SELECT host, seqno, '
+                            'ROW_NUMBER() OVER (PARTITION BY host ORDER BY '
+                            f'{order} DESC, seqno DESC) AS n FROM {table}) '
+                            'WHERE n = 1'):
+                        self.seqnos.setdefault(host_, [0, 0])[column] = seqno
+
+            return tuple(self.seqnos.get(host, (0, 0)))
+
+    def restart(self, host):
+        ''' Fetch all of the messages and notices of host next time, its
+            core client having restarted
+        '''
+        self.since(host)
+        with self.lock:
+            self.seqnos[host] = [0, 0]
+
+    def ingest(self, host, messages, notices):
+        ''' Store the message_record() and notice_record() dicts of host
+            that aren't yet. Return how many messages and notices were
+            added.
+        '''
+        self.since(host)
+        if not (messages or notices):
+            return 0, 0
+
+        db = self.connect()
+        try:
+            with db:
+                addedMessages = db.executemany(
+                    'INSERT OR IGNORE INTO message VALUES (?, ?, ?, ?, ?, ?)',
+                    [tuple(record[field] for field in MESSAGE_FIELDS)
+                     for record in messages]).rowcount
+                addedNotices = db.executemany(
+                    'INSERT OR IGNORE INTO notice '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    [tuple(record[field] for field in NOTICE_FIELDS)
+                     for record in notices]).rowcount
+        finally:
+            db.close()
+
+        with self.lock:
+            seqnos = self.seqnos.setdefault(host, [0, 0])
+            if messages:
+                seqnos[0] = max(seqnos[0], max(r['seqno'] for r in messages))
+            if notices:
+                seqnos[1] = max(seqnos[1], max(r['seqno'] for r in notices))
+
+        return max(addedMessages, 0), max(addedNotices, 0)
+
+    def messages(self, text='', limit=100, **filters):
+        ''' Return the (number of matches, list of the last limit message
+            records) whose body contains text, ignoring case, and with the
+            given MESSAGE_FILTERS values, newest first
+        '''
+        where, params = [], []
+        for field in MESSAGE_FILTERS:
+            if filters.get(field) not in (None, ''):
+                where.append(f'{field} = ?')
+                params.append(filters[field])
+
+        return self.search('message', MESSAGE_FIELDS, 'time', where, params,
+                           limit, text, ('body',))
+
+    def notices(self, text='', limit=100, host=None):
+        ''' Return the (number of matches, list of the last limit notice
+            records) of host, or all, whose title or description contains
+            text, ignoring case, newest first
+        '''
+        where, params = [], []
+        if host:
+            where.append('host = ?')
+            params.append(host)
+
+        return self.search('notice', NOTICE_FIELDS, 'create_time', where,
+                           params, limit, text, ('title', 'description'))
+
+    def matching(self, table, columns, text, where, params):
+        ''' Add the condition of the rows of table whose columns contain
+            text, ignoring case, to where and params
+        '''
+        if self.fts and len(text) >= FTS_MIN_LENGTH:
+            where.append(f'rowid IN (SELECT rowid FROM {table}_fts '
+                         f'WHERE {table}_fts MATCH ?)')
+            params.append(phrase(text))
+        else:
+            where.append('(' + ' OR '.join(f"{column} LIKE ? ESCAPE '\\'"
+                                           for column in columns) + ')')
+            params.extend([like(text)] * len(columns))
+
+    def search(self, table, fields, order, where, params, limit, text,
+               columns):
+        db = self.connect()
+        if text:
+            self.matching(table, columns, text, where, params)
+        condition = ('WHERE ' + ' AND '.join(where)) if where else ''
+        try:
+            count = db.execute(f'SELECT COUNT(*) FROM {table} {condition}',
+                               params).fetchone()[0]
+            rows = db.execute(
+                f'SELECT {", ".join(fields)} FROM {table} {condition} '
+                f'ORDER BY {order} DESC, seqno DESC LIMIT ?',
+                # SQLite takes a negative limit as no limit at all
+                params + [max(limit, 0)]).fetchall()
+        finally:
+            db.close()
+
+        return count, [dict(zip(fields, row)) for row in rows]
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# history.py - Store of the completed tasks of the cluster
+#
+#    Copyright (C) 2020 Jonathan Drake (drakej) <952345+drakej@users.noreply.github.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+# Core clients only remember the tasks they completed in the last hour or so
+# (get_old_results). They are copied to a SQLite file as they're polled, once
+# per (host, name, completed_time), and kept for throughput and run time
+# analytics.
+
+import sqlite3
+import threading
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS old_result (
+    host TEXT NOT NULL,
+    name TEXT NOT NULL,
+    project_url TEXT NOT NULL,
+    app_name TEXT NOT NULL,
+    exit_status INTEGER NOT NULL,
+    elapsed_time REAL NOT NULL,
+    cpu_time REAL NOT NULL,
+    create_time REAL NOT NULL,
+    completed_time REAL NOT NULL,
+    PRIMARY KEY (host, name, completed_time)
+);
+CREATE INDEX IF NOT EXISTS old_result_completed ON old_result (completed_time);
+CREATE INDEX IF NOT EXISTS old_result_project
+    ON old_result (project_url, completed_time);
+CREATE INDEX IF NOT EXISTS old_result_app ON old_result (app_name, completed_time);
+'''
+
+# Columns the analytics can be grouped by
+GROUPS = {
+    'host': 'host',
+    'project': 'project_url',
+    'app': 'app_name'
+}
+
+SECONDS_PER_DAY = 86400
+
+# Seconds core clients keep their old results for
+OLD_RESULTS_KEPT = 3600
+
+# client.OldResult attributes of the columns of results()
+RESULT_FIELDS = ('project_url', 'result_name', 'app_name', 'exit_status',
+                 'elapsed_time', 'cpu_time', 'completed_time', 'create_time')
+
+
+class ResultHistory(object):
+    ''' SQLite file of the old results of every host. The collector adds
+        them, web workers only query them.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        # latest completed_time stored, by host
+        self.latest = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        db = sqlite3.connect(self.path)
+        # readers in other processes don't block the collector
+        db.execute('PRAGMA journal_mode=WAL')
+        db.executescript(SCHEMA)
+        return db
+
+    def query(self, sql, params=()):
+        db = self.connect()
+        try:
+            return db.execute(sql, params).fetchall()
+        finally:
+            db.close()
+
+    def ingest(self, host, results):
+        ''' Store the client.OldResults of host that aren't yet. Return how
+            many were added.
+        '''
+        with self.lock:
+            if self.latest is None:
+                self.latest = dict(self.query(
+                    'SELECT host, MAX(completed_time) FROM old_result '
+                    'GROUP BY host'))
+
+            # old results are only ever appended on a host, so anything
+            # completed before the latest stored one is already in
+            latest = self.latest.get(host, 0.0)
+            rows = [(host, result.result_name, result.project_url,
+                     result.app_name, result.exit_status, result.elapsed_time,
+                     result.cpu_time, result.create_time, result.completed_time)
+                    for result in results if result.completed_time >= latest]
+            if not rows:
+                return 0
+
+            db = self.connect()
+            try:
+                with db:
+                    added = db.executemany(
+                        'INSERT OR IGNORE INTO old_result '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows).rowcount
+            finally:
+                db.close()
+
+            self.latest[host] = max(latest, max(row[8] for row in rows))
+            return added
+
+    def throughput(self, group, since):
+        ''' Return (day, key, completed tasks) rows per day and group since
+            timestamp since, day being the UTC date as 'YYYY-MM-DD'
+        '''
+        column = GROUPS[group]
+        return self.query(
+            f"SELECT date(completed_time, 'unixepoch') AS day, {column}, "
+            'COUNT(*) FROM old_result WHERE completed_time >= ? '
+            f'GROUP BY day, {column} ORDER BY day, {column}', (since,))
+
+    def run_times(self, group, since):
+        ''' Return (key, tasks, average elapsed time, average CPU time,
+            errors) rows per group since timestamp since
+        '''
+        column = GROUPS[group]
+        return self.query(
+            f'SELECT {column}, COUNT(*), AVG(elapsed_time), AVG(cpu_time), '
+            'SUM(exit_status != 0) FROM old_result WHERE completed_time >= ? '
+            f'GROUP BY {column} ORDER BY {column}', (since,))
+
+    def results(self, host, since):
+        ''' Return the old results of host completed since timestamp since,
+            as dicts of RESULT_FIELDS, oldest first
+        '''
+        return [dict(zip(RESULT_FIELDS, row)) for row in self.query(
+            'SELECT project_url, name, app_name, exit_status, elapsed_time, '
+            'cpu_time, completed_time, create_time FROM old_result '
+            'WHERE host = ? AND completed_time >= ? ORDER BY completed_time',
+            (host, since))]
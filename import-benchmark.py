@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# import-benchmark.py - Import time of the boinc-cluster modules
+#
+#    Copyright (C) 2020 Jonathan Drake (drakej) <952345+drakej@users.noreply.github.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+# Imports each module in fresh interpreters and prints the median time
+# reported by python -X importtime, along with the heavy dependencies that
+# came along. Scripts and cron jobs pay this on every run, so keep client
+# and rpc free of anything but the standard library essentials.
+#
+# Usage: python3 import-benchmark.py [-n RUNS] [module ...]
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+MODULES = ('rpc', 'client', 'symbols', 'snapshot', 'collector', 'boinccluster')
+
+# Dependencies worth flagging when a module pulls them in
+HEAVY = ('flask', 'jinja2', 'werkzeug', 'multiprocessing', 'sqlite3',
+         'configparser')
+
+
+def measure(module):
+    ''' Return (microseconds, heavy modules loaded) of one import of module '''
+    code = ('import sys; import %s; print(",".join(m for m in %r if m in sys.modules))'
+            % (module, HEAVY))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True)
+
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]), result.stdout.strip()
+    raise RuntimeError(f"No import time reported for {module}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Import time of the boinc-cluster modules')
+    parser.add_argument('-n', '--runs', type=int, default=10)
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    args = parser.parse_args()
+
+    for module in args.modules:
+        runs = [measure(module) for i in range(args.runs)]
+        median = statistics.median(us for us, heavy in runs) / 1000
+        heavy = runs[-1][1] or '-'
+        print(f"{module:<14} {median:8.1f} ms   {heavy}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# model.py - Indexed client state of each host of the cluster
+#
+#    Copyright (C) 2020 Jonathan Drake (drakej) <952345+drakej@users.noreply.github.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+# Work unit names, app versions and even app names only mean something within
+# the client state of one host, so each host gets its own HostModel: the
+# projects, apps, app versions, work units and results of its last
+# client.CCState, indexed by the keys of CCState.diff(). Results fetched on
+# their own are then resolved against the model of their host, the way
+# CC_STATE does in gui_rpc_client.cpp.
+#
+# Models are never changed once built, a newer state makes a new model
+# sharing the indexes that didn't change.
+
+import client
+
+
+class HostModel(object):
+    ''' Client state of one host, with its items indexed by key '''
+
+    def __init__(self, state, indexes):
+        self.state = state
+        self.indexes = indexes
+
+    @classmethod
+    def build(cls, state):
+        ''' Return the HostModel of a client.CCState '''
+        return cls(state, {name: {key(item): item
+                                  for item in getattr(state, name)}
+                           for name, key in client.CCState._keys.items()})
+
+    def update(self, state):
+        ''' Return the HostModel of state, a newer client.CCState of the same
+            host, applying only what changed since the state of this model.
+            Indexes without changes are shared with this model.
+        '''
+        changes = state.diff(self.state)
+        if not changes:
+            return self
+
+        indexes = dict(self.indexes)
+        for name, key in client.CCState._keys.items():
+            items = changes.added[name] + changes.changed[name]
+            if not (items or changes.removed[name]):
+                continue
+
+            index = indexes[name] = dict(indexes[name])
+            for itemKey in changes.removed[name]:
+                del index[itemKey]
+            for item in items:
+                index[key(item)] = item
+
+        return HostModel(state, indexes)
+
+    def lookup_project(self, url):
+        return self.indexes['projects'].get(url)
+
+    def lookup_app(self, name):
+        return self.indexes['apps'].get(name)
+
+    def lookup_app_version(self, app_name, version_num, platform, plan_class):
+        return self.indexes['app_versions'].get(
+            (app_name, version_num, platform, plan_class))
+
+    def lookup_wu(self, name):
+        return self.indexes['work_units'].get(name)
+
+    def lookup_result(self, name):
+        return self.indexes['results'].get(name)
+
+    def resolve(self, result):
+        ''' Point the project, wup, app and avp of a client.Result of this
+            host to the matching items of the model, None for those it
+            doesn't know of. Return result.
+        '''
+        result.project = self.lookup_project(result.project_url)
+        result.wup = self.lookup_wu(result.wu_name)
+        result.app = result.avp = None
+
+        if result.wup is not None:
+            result.app = self.lookup_app(result.wup.app_name)
+            result.avp = self.lookup_app_version(
+                result.wup.app_name, result.version_num, result.platform or "",
+                result.plan_class)
+
+        return result
@@ -0,0 +1,12 @@
+#!/bin/bash
+
+# Production setup: collector.py owns the BOINC connections and publishes the
+# collected state to gunicorn web workers (see [collector] in config.ini).
+# You need to setup a virtual environment with Python3 in .env to make this script work correctly
+source .env/bin/activate
+
+python collector.py &
+COLLECTOR=$!
+trap "kill $COLLECTOR" EXIT
+
+gunicorn --workers ${WORKERS:-4} --threads ${THREADS:-8} --bind 0.0.0.0:8000 wsgi:app
@@ -21,7 +21,10 @@
 
 # A replacement of gui_rpc_client for basic RPC calls, with a sane API
 
+import hashlib
 import socket
+import threading
+from collections import OrderedDict
 from xml.etree import ElementTree
 import logging
 
@@ -31,6 +34,16 @@ GUI_RPC_HOSTNAME = None  # localhost
 GUI_RPC_PORT = 31416
 GUI_RPC_TIMEOUT = 5
 
+# End-of-message marker for both requests and replies
+END = b'\003'
+
+# Stands for a reply identical to the known one, see Rpc.call_many()
+UNCHANGED = object()
+
+# Request texts whose last reply digest is kept, least recently used first
+# out
+MAX_DIGESTS = 64
+
 
 class Rpc(object):
     ''' Class to perform GUI RPC calls to a BOINC core client.
@@ -45,6 +58,13 @@ class Rpc(object):
         self.timeout = timeout
         self.sock = None
         self.text_output = text_output
+        self._buffer = b""
+        # One exchange at a time, threads sharing a connection would
+        # otherwise interleave their requests and steal each other's replies
+        self.lock = threading.RLock()
+        # Digest of the last raw reply to each request, by request text, for
+        # the MAX_DIGESTS requests made last
+        self.digests = OrderedDict()
 
     @property
     def sockargs(self):
@@ -75,6 +95,7 @@ class Rpc(object):
         if self.sock:
             self.sock.close()
             self.sock = None
+        self._buffer = b""
 
     def call(self, request, text_output=None):
         ''' Do an RPC call. Pack and send the XML request and return the
@@ -83,45 +104,103 @@ class Rpc(object):
             or XML text according to text_output flag.
             Will auto-connect if not connected.
         '''
+        return self.call_many([request], text_output)[0]
+
+    def call_many(self, requests, text_output=None, pipeline=True,
+                  known=None):
+        ''' Do several RPC calls over the same connection and return the
+            list of unpacked replies, in the same order as requests.
+            With pipeline, all framed requests are written back-to-back
+            before any reply is read, so the whole batch costs roughly one
+            round-trip. Without it, each request waits for its reply, as
+            call() does.
+            Note that core clients which read a single request per recv()
+            drop anything after the first end-of-message marker, so only
+            enable pipelining for clients known to handle it.
+            known maps request texts to the digest of a reply the caller
+            already has the result of. A reply with that same digest isn't
+            unpacked, UNCHANGED is returned in its place.
+        '''
         if text_output is None:
             text_output = self.text_output
 
+        with self.lock:
+            return self._call_many(requests, text_output, pipeline,
+                                   known or {})
+
+    def _call_many(self, requests, text_output, pipeline, known):
         if not self.sock:
             self.connect(*self.sockargs)
 
-        if not isinstance(request, ElementTree.Element):
-            request = ElementTree.fromstring(request)
-
-        # pack request
-        end = b'\003'
-        req = b"<boinc_gui_rpc_request>\n%s\n</boinc_gui_rpc_request>\n%s" \
-            % (ElementTree.tostring(request).replace(b' />', b'/>'), end)
-
-        try:
-            self.sock.sendall(req)
-        except (socket.error, socket.herror, socket.gaierror, socket.timeout):
-            raise
-
-        req = b""
-        while True:
-            try:
-                buf = self.sock.recv(8192)
-                if not buf:
-                    raise socket.error("No data from socket")
-            except socket.error:
-                raise
-            n = buf.find(end)
-            if not n == -1:
-                break
-            req += buf
-        req += buf[:n]
-
-        # unpack reply (remove root tag, ie: first and last lines)
-        req = b"\n".join(req.strip().rsplit(b"\n")[1:-1])
+        keys = [ElementTree.tostring(request, encoding='unicode')
+                if isinstance(request, ElementTree.Element) else request
+                for request in requests]
+        requests = [request if isinstance(request, ElementTree.Element)
+                    else ElementTree.fromstring(request)
+                    for request in requests]
+
+        replies = []
+        if pipeline:
+            self.sock.sendall(b"".join(self.pack(r) for r in requests))
+            for key, request in zip(keys, requests):
+                replies.append(self.receive_unpacked(key, request, text_output,
+                                                     known))
+        else:
+            for key, request in zip(keys, requests):
+                self.sock.sendall(self.pack(request))
+                replies.append(self.receive_unpacked(key, request, text_output,
+                                                     known))
+
+        return replies
+
+    def receive_unpacked(self, key, request, text_output, known):
+        ''' receive() and unpack() the reply to request, recording its
+            digest in self.digests[key]. Return UNCHANGED instead if the
+            digest is the one known for key.
+        '''
+        reply = self.receive()
+        digest = hashlib.blake2b(reply, digest_size=16).digest()
+        self.digests[key] = digest
+        self.digests.move_to_end(key)
+        if len(self.digests) > MAX_DIGESTS:
+            self.digests.popitem(last=False)
+        if known.get(key) == digest:
+            return UNCHANGED
+        return self.unpack(request, reply, text_output)
+
+    @staticmethod
+    def pack(request):
+        ''' Frame an ElementTree.Element as a GUI RPC request message '''
+        return b"<boinc_gui_rpc_request>\n%s\n</boinc_gui_rpc_request>\n%s" \
+            % (ElementTree.tostring(request).replace(b' />', b'/>'), END)
+
+    def receive(self):
+        ''' Read one reply message, up to (and excluding) the end marker.
+            Bytes past the marker belong to the next reply of a pipelined
+            batch and are kept for the following receive()
+        '''
+        reply = self._buffer
+        n = reply.find(END)
+        while n == -1:
+            buf = self.sock.recv(8192)
+            if not buf:
+                raise socket.error("No data from socket")
+            # only the new chunk can contain the marker
+            offset = len(reply)
+            reply += buf
+            n = reply.find(END, offset)
+        self._buffer = reply[n + 1:]
+        return reply[:n]
+
+    def unpack(self, request, reply, text_output):
+        ''' Unpack a reply message (remove root tag, ie: first and last
+            lines), returning ElementTree.Element or XML text
+        '''
+        reply = b"\n".join(reply.strip().rsplit(b"\n")[1:-1])
 
         LOGGER.debug(f"RPC {request.tag} call made on host {self.hostname}")
 
         if text_output:
-            return req
+            return reply
         else:
-            return ElementTree.fromstring(req)
+            return ElementTree.fromstring(reply)
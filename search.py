@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# search.py - Search index over the tasks, work units and projects
+#
+#    Copyright (C) 2020 Jonathan Drake (drakej) <952345+drakej@users.noreply.github.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+# Each document (a task, work unit or project of a host) is indexed by the
+# trigrams of its lowercased text, for substring search, by the first one or
+# two characters of its name, for shorter queries, and by the exact values
+# of its attributes (host, project, app, plan class, state...). A query
+# intersects the sets of ids of its trigrams and attributes, smallest first,
+# and only checks the remaining candidates against the text.
+#
+# Documents are replaced per (kind, host), and only when what they were
+# built from changed, so following the snapshots costs the hosts that were
+# polled, not the whole cluster.
+
+import heapq
+import threading
+
+# Separates the fields of the text of a document, so no trigram spans two
+TEXT_SEPARATOR = '\0'
+
+EMPTY = frozenset()
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex(object):
+    ''' Index of documents, dicts with at least the kind, host and name keys,
+        identified by (kind, host, name)
+    '''
+
+    def __init__(self):
+        self.documents = {}
+        self.texts = {}  # lowercased text, by id
+        self.grams = {}  # ids by trigram
+        self.prefixes = {}  # ids by first one or two characters of the name
+        self.attributes = {}  # ids by (field, value)
+        self.tags = {}  # (field, value) pairs, by id
+        # (source, ids) of the documents of each (kind, host)
+        self.sources = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, document, text, attributes):
+        ''' Index document under text, and its attributes, a {field: values}
+            dict
+        '''
+        key = (document['kind'], document['host'], document['name'])
+        name = document['name'].lower()
+
+        self.documents[key] = document
+        self.texts[key] = text
+        for gram in trigrams(text):
+            self.grams.setdefault(gram, set()).add(key)
+        for prefix in {name[:1], name[:2]}:
+            self.prefixes.setdefault(prefix, set()).add(key)
+        pairs = self.tags[key] = [('kind', key[0])] + [
+            (field, value) for field, values in attributes.items()
+            for value in values]
+        for attribute in pairs:
+            self.attributes.setdefault(attribute, set()).add(key)
+
+    def remove(self, key):
+        document = self.documents.pop(key)
+        text = self.texts.pop(key)
+        name = document['name'].lower()
+
+        for gram in trigrams(text):
+            self.discard(self.grams, gram, key)
+        for prefix in {name[:1], name[:2]}:
+            self.discard(self.prefixes, prefix, key)
+        for attribute in self.tags.pop(key):
+            self.discard(self.attributes, attribute, key)
+
+    @staticmethod
+    def discard(index, value, key):
+        keys = index.get(value)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del index[value]
+
+    def replace(self, kind, host, source, build):
+        ''' Make the documents of kind of host the (document, texts,
+            attributes) list returned by build(), unless source, what
+            build() works from, is the same as last time. texts are the
+            strings searched, attributes the {field: values} to filter on;
+            documents that are equal to their previous version, with the
+            same texts, are left as they are.
+        '''
+        with self.lock:
+            old = self.sources.get((kind, host))
+            if old is not None and (old[0] is source or old[0] == source):
+                return
+
+            keys = set()
+            for document, texts, attributes in build():
+                key = (kind, host, document['name'])
+                text = TEXT_SEPARATOR.join(texts).lower()
+                keys.add(key)
+                if key in self.documents:
+                    if (self.documents[key] == document
+                            and self.texts[key] == text):
+                        continue
+                    self.remove(key)
+                self.add(document, text, attributes)
+
+            for key in (old[1] if old else EMPTY) - keys:
+                self.remove(key)
+
+            self.sources[(kind, host)] = (source, keys)
+
+    def find(self, query='', limit=None, **attributes):
+        ''' Return (number of matches, list of the first limit matching
+            documents by id). Documents match when query is part of their
+            text, or starts their name for queries under three characters,
+            and they have the given attribute values.
+        '''
+        query = query.lower()
+
+        with self.lock:
+            sets = [self.attributes.get((field, value), EMPTY)
+                    for field, value in attributes.items() if value]
+            if len(query) >= 3:
+                sets.extend(self.grams.get(gram, EMPTY)
+                            for gram in trigrams(query))
+            elif query:
+                sets.append(self.prefixes.get(query, EMPTY))
+
+            if not sets:
+                keys = set(self.documents)
+            else:
+                sets.sort(key=len)
+                keys = sets[0].intersection(*sets[1:])
+
+            if len(query) >= 3:
+                keys = [key for key in keys if query in self.texts[key]]
+
+            if limit is None:
+                first = sorted(keys)
+            else:
+                first = heapq.nsmallest(limit, keys)
+            return len(keys), [self.documents[key] for key in first]
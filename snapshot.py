@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# snapshot.py - Versioning of the data collected from the cluster
+#
+#    Copyright (C) 2020 Jonathan Drake (drakej) <952345+drakej@users.noreply.github.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+import threading
+from collections import OrderedDict
+import time
+
+# Distinguishes versions of this process from those of a previous run, which
+# also start counting from 1
+EPOCH = '%x' % int(time.time())
+
+
+class Dataset(object):
+    ''' Version bookkeeping of one kind of collected data (tasks, statistics,
+        disk usage...). Each completed collection cycle publishes a new
+        version, and cycles closer than interval seconds apart are skipped,
+        so everything derived from a version (ETags, rendered pages) stays
+        valid until the next one. Datasets are immutable, published()
+        returns the next version. A dataset restored from disk (see
+        store.py) is stale until a collection cycle publishes it again, and
+        keeps the epoch of the run that saved it until then: versions
+        published after belong to this run's EPOCH, since the previous run
+        may have gone past the one saved.
+    '''
+
+    __slots__ = ('name', 'interval', 'epoch', 'version', 'modified', 'restored')
+
+    def __init__(self, name, interval=0, epoch=EPOCH, version=0, modified=0.0,
+                 restored=False):
+        self.name = name
+        self.interval = interval
+        self.epoch = epoch
+        self.version = version
+        self.modified = modified
+        self.restored = restored
+
+    @property
+    def tag(self):
+        return '%s%d' % (self.name, self.version)
+
+    def stale(self):
+        ''' Whether a new collection cycle is due '''
+        return self.restored or time.time() - self.modified >= self.interval
+
+    def published(self):
+        return Dataset(self.name, self.interval, EPOCH, self.version + 1,
+                       time.time())
+
+
+class Snapshot(object):
+    ''' Everything collected from the cluster at one point in time: the
+        datasets dict of Dataset versions plus named fields holding the data.
+        A published snapshot is never modified, and neither are the
+        containers it holds. Collection cycles build new ones and publish()
+        a copy of the current snapshot with them replaced, so a request
+        reads current() once and gets consistent data without any locking.
+    '''
+
+    def __init__(self, datasets, **fields):
+        self.__dict__.update(fields, datasets=datasets)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Snapshot is immutable, can't set {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"Snapshot is immutable, can't delete {name}")
+
+    def replace(self, **changes):
+        ''' Return a copy of this snapshot with the given fields replaced '''
+        fields = dict(self.__dict__, **changes)
+        return Snapshot(**fields)
+
+
+_current = Snapshot({})
+_lock = threading.Lock()
+
+
+def current():
+    ''' Return the latest published Snapshot '''
+    return _current
+
+
+def install(snap):
+    ''' Make snap the current Snapshot, as received from the collector '''
+    global _current
+    _current = snap
+
+
+def publish(name=None, **changes):
+    ''' Swap in a copy of the current Snapshot with the given fields
+        replaced, and a new version of the named dataset when given.
+        Publications are serialized, so concurrent collection cycles of
+        different datasets don't drop each other's changes. Return the new
+        Snapshot.
+    '''
+    global _current
+    with _lock:
+        if name is not None:
+            datasets = dict(_current.datasets)
+            datasets[name] = datasets[name].published()
+            changes['datasets'] = datasets
+        _current = _current.replace(**changes)
+        return _current
+
+
+def etag(datasets):
+    ''' Return the entity tag of a response built from datasets. Their epochs
+        are those of the processes that collected them, so all the web
+        workers fed by the same collector agree on tags. Restored datasets
+        may still have the epoch of a previous run while others have this
+        run's, each distinct epoch is part of the tag.
+    '''
+    epochs = list(OrderedDict.fromkeys(dataset.epoch
+                                       for dataset in datasets))
+    return '-'.join(epochs + [dataset.tag for dataset in datasets])
+
+
+def modified(datasets):
+    ''' Return the time of the latest change among datasets '''
+    return max(dataset.modified for dataset in datasets)
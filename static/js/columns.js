@@ -0,0 +1,37 @@
+// Decoders for the columnar JSON format of /tasks/live
+// (application/vnd.boinc-cluster.columns+json)
+
+// Turn {count, columns: {field: [...]}, symbols: [...]} into an array of row
+// objects, resolving the ids of symbolFields through the symbol table
+function decodeColumns(json, symbolFields) {
+    var rows = new Array(json.count);
+    var fields = Object.keys(json.columns);
+
+    for (var i = 0; i < json.count; i++) {
+        rows[i] = {};
+    }
+
+    fields.forEach(function (field) {
+        var column = json.columns[field];
+        var symbolic = symbolFields.indexOf(field) !== -1;
+
+        for (var i = 0; i < json.count; i++) {
+            rows[i][field] = symbolic ? json.symbols[column[i]] : column[i];
+        }
+    });
+
+    return rows;
+}
+
+// Format seconds as "[Nd ]HH:MM:SS"
+function formatDuration(seconds) {
+    var days = Math.floor(seconds / 86400);
+    var rest = seconds - days * 86400;
+    var hours = Math.floor(rest / 3600);
+    var minutes = Math.floor((rest - hours * 3600) / 60);
+    var secs = Math.floor(rest - hours * 3600 - minutes * 60);
+    var pad = function (n) { return String(n).padStart(2, '0'); };
+    var text = pad(hours) + ':' + pad(minutes) + ':' + pad(secs);
+
+    return days ? days + 'd ' + text : text;
+}
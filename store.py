@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# store.py - On-disk copy of the collected snapshot
+#
+#    Copyright (C) 2020 Jonathan Drake (drakej) <952345+drakej@users.noreply.github.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+# The latest version of each dataset is kept in a SQLite file, one row per
+# dataset holding the compressed pickle of its snapshot fields, so a restart
+# can show the last known state of the cluster right away instead of an
+# empty dashboard until every host answered.
+
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+import logging
+
+import snapshot
+
+LOGGER = logging.getLogger('boinc-cluster')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS dataset (
+    name TEXT PRIMARY KEY,
+    epoch TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    modified REAL NOT NULL,
+    data BLOB NOT NULL
+)'''
+
+
+class SnapshotStore(object):
+    ''' SQLite file holding the latest saved version of each dataset.
+        fields maps each dataset name to the Snapshot fields it covers.
+    '''
+
+    def __init__(self, path, fields):
+        self.path = path
+        self.fields = fields
+        # versions on disk, by dataset name
+        self.saved = {}
+
+    def connect(self):
+        db = sqlite3.connect(self.path)
+        db.execute(SCHEMA)
+        return db
+
+    def load(self):
+        ''' Return the current Snapshot with the saved datasets in place of
+            its own, or None when nothing was saved yet. Restored datasets
+            keep their version and modification time, but are flagged
+            restored, and thus stale, until the next collection cycle
+            publishes them.
+        '''
+        db = self.connect()
+        try:
+            rows = db.execute('SELECT name, epoch, version, modified, data '
+                              'FROM dataset').fetchall()
+        finally:
+            db.close()
+
+        current = snapshot.current()
+        datasets = dict(current.datasets)
+        fields = {}
+        for name, epoch, version, modified, data in rows:
+            if name not in datasets or name not in self.fields:
+                continue
+            try:
+                values = pickle.loads(zlib.decompress(data))
+            except Exception as error:
+                # e.g. saved by an older version of the client classes
+                LOGGER.info(f"Couldn't restore saved {name}: {error}")
+                continue
+            fields.update(values)
+            datasets[name] = snapshot.Dataset(
+                name, datasets[name].interval, epoch, version, modified,
+                restored=True)
+            self.saved[name] = (epoch, version)
+
+        if not fields:
+            return None
+        return current.replace(datasets=datasets, **fields)
+
+    def save(self, snap):
+        ''' Write the datasets of snap whose version isn't on disk yet '''
+        rows = []
+        for name, dataset in snap.datasets.items():
+            key = (dataset.epoch, dataset.version)
+            if (not dataset.version or dataset.restored
+                    or name not in self.fields or self.saved.get(name) == key):
+                continue
+            values = {field: getattr(snap, field) for field in self.fields[name]}
+            data = zlib.compress(pickle.dumps(values, pickle.HIGHEST_PROTOCOL))
+            rows.append((name, dataset.epoch, dataset.version,
+                         dataset.modified, data, key))
+
+        if not rows:
+            return
+
+        db = self.connect()
+        try:
+            with db:
+                db.executemany('INSERT OR REPLACE INTO dataset '
+                               'VALUES (?, ?, ?, ?, ?)',
+                               [row[:5] for row in rows])
+        finally:
+            db.close()
+
+        for row in rows:
+            self.saved[row[0]] = row[5]
+
+    def start(self, interval):
+        ''' Save the current snapshot every interval seconds from a
+            background thread
+        '''
+        thread = threading.Thread(target=self.run, args=(interval,),
+                                  daemon=True)
+        thread.start()
+
+    def run(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.save(snapshot.current())
+            except (sqlite3.Error, OSError) as error:
+                LOGGER.error(f"Couldn't save snapshot to {self.path}: {error}")
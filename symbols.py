@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# symbols.py - Shared string table for the cluster snapshot
+#
+#    Copyright (C) 2020 Jonathan Drake (drakej) <952345+drakej@users.noreply.github.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+# Task rows repeat the same host, project, application and status strings
+# thousands of times. A SymbolTable keeps one copy of each and numbers them,
+# so rows can share the string objects in memory and ship small integer ids
+# plus a single lookup table in JSON output.
+
+
+class SymbolTable(object):
+    ''' Cluster-wide table of repeated strings. Each distinct string gets a
+        small integer id, the position of the string in symbols
+    '''
+
+    def __init__(self):
+        self.ids = {}
+        self.symbols = []
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, value):
+        return value in self.ids
+
+    def id(self, value):
+        ''' Return the id of value, adding it to the table if needed '''
+        try:
+            return self.ids[value]
+        except KeyError:
+            symbol_id = self.ids[value] = len(self.symbols)
+            self.symbols.append(value)
+            return symbol_id
+
+    def intern(self, value):
+        ''' Return the table's own copy of value, so equal strings share a
+            single object
+        '''
+        return self.symbols[self.id(value)]
+
+    def lookup(self, symbol_id):
+        return self.symbols[symbol_id]
+
+    def encode(self, rows, fields):
+        ''' Return a copy of the dict rows with the values of fields replaced
+            by their ids
+        '''
+        encoded = []
+        for row in rows:
+            row = dict(row)
+            for field in fields:
+                row[field] = self.id(row[field])
+            encoded.append(row)
+        return encoded
+
+    def encode_columns(self, rows, fields, symbol_fields=()):
+        ''' Return the dict rows as a {field: [value, ...]} dict of column
+            arrays, with the values of symbol_fields replaced by their ids
+        '''
+        columns = {}
+        for field in fields:
+            if field in symbol_fields:
+                columns[field] = [self.id(row[field]) for row in rows]
+            else:
+                columns[field] = [row[field] for row in rows]
+        return columns
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# taskindex.py - Sorted and filtered pages of the task rows
+#
+#    Copyright (C) 2020 Jonathan Drake (drakej) <952345+drakej@users.noreply.github.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+# The tasks table pages through the task rows on the server (DataTables
+# server-side processing) instead of loading all of them in the browser.
+# A TaskIndex is built once per version of the rows: the positions of the
+# rows holding each host, project and state, and the order of the rows by
+# each sortable field, built on first use. The ordered positions of a given
+# combination of filters are cached too, so paging, or reloading the same
+# page, only costs the rows of the page.
+
+import threading
+from collections import OrderedDict
+
+# Row fields that can be filtered on, by exact value
+FILTER_FIELDS = ('hostname', 'projectName', 'state')
+
+# Row fields that can be sorted on
+SORT_FIELDS = ('hostname', 'projectName', 'percent', 'status',
+               'elapsedSeconds', 'remainingSeconds', 'deadline',
+               'application', 'name')
+
+# Row fields searched by the search box of the table
+SEARCH_FIELDS = ('hostname', 'projectName', 'application', 'status', 'name')
+
+# Filtered and ordered views kept per TaskIndex
+MAX_VIEWS = 32
+
+
+class TaskIndex(object):
+    ''' Indexes of a tuple of task rows, which must not change afterwards.
+        find, if given, returns the (hostname, name) of the rows matching a
+        search of three characters or more, see search.SearchIndex;
+        otherwise, and for shorter searches, the rows are scanned.
+    '''
+
+    def __init__(self, tasks, find=None):
+        self.tasks = tasks
+        self.find = find
+        # positions of the rows, by (hostname, name)
+        self.keys = {}
+        if find is not None:
+            self.keys = {(row['hostname'], row['name']): position
+                         for position, row in enumerate(tasks)}
+        # positions of the rows, by field and value
+        self.facets = {field: {} for field in FILTER_FIELDS}
+        for position, row in enumerate(tasks):
+            for field in FILTER_FIELDS:
+                self.facets[field].setdefault(row[field], []).append(position)
+
+        # ascending positions of the rows, by field
+        self.orders = {}
+        # positions of the rows, by (field, filters, search)
+        self.views = OrderedDict()
+        self.lock = threading.Lock()
+
+    def values(self, field):
+        ''' Return the sorted distinct values of a FILTER_FIELDS field '''
+        return sorted(self.facets[field])
+
+    def order(self, field):
+        if field not in self.orders:
+            tasks = self.tasks
+            self.orders[field] = sorted(range(len(tasks)),
+                                        key=lambda position: tasks[position][field])
+        return self.orders[field]
+
+    def matching(self, filters, search):
+        ''' Return the set of the positions of the rows matching all
+            filters, a {field: value} dict, and containing search in one of
+            their SEARCH_FIELDS, ignoring case
+        '''
+        positions = None
+        for field, value in filters.items():
+            found = set(self.facets[field].get(value, ()))
+            positions = found if positions is None else positions & found
+
+        if search and self.find is not None and len(search) >= 3:
+            found = {self.keys[key] for key in self.find(search)
+                     if key in self.keys}
+            positions = found if positions is None else positions & found
+        elif search:
+            search = search.lower()
+            candidates = range(len(self.tasks)) if positions is None \
+                else positions
+            positions = {position for position in candidates
+                         if any(search in self.tasks[position][field].lower()
+                                for field in SEARCH_FIELDS)}
+
+        return positions
+
+    def view(self, field=None, filters={}, search=''):
+        ''' Return the list of the positions of the matching rows, in
+            ascending order of field, or in the order of the rows
+        '''
+        key = (field, tuple(sorted(filters.items())), search)
+
+        with self.lock:
+            if key in self.views:
+                self.views.move_to_end(key)
+                return self.views[key]
+
+            order = range(len(self.tasks)) if field is None \
+                else self.order(field)
+            matching = self.matching(filters, search)
+            if matching is None:
+                positions = list(order)
+            else:
+                positions = [position for position in order
+                             if position in matching]
+
+            self.views[key] = positions
+            if len(self.views) > MAX_VIEWS:
+                self.views.popitem(last=False)
+            return positions
+
+    def page(self, start, length, field=None, descending=False, filters={},
+             search=''):
+        ''' Return (number of matching rows, list of the rows of the page
+            starting at the start-th one), all of the remaining rows if
+            length is negative
+        '''
+        positions = self.view(field, filters, search)
+        count = len(positions)
+        if length < 0:
+            length = count
+
+        if descending:
+            end = max(count - start, 0)
+            page = positions[max(end - length, 0):end][::-1]
+        else:
+            page = positions[start:start + length]
+
+        return count, [self.tasks[position] for position in page]
@@ -0,0 +1,10 @@
+#!/usr/bin/python3
+
+# WSGI entry point of the production setup, e.g.
+#   gunicorn --workers 4 --threads 8 --bind 0.0.0.0:8000 wsgi:app
+# With a [collector] section in config.ini, each worker is fed by collector.py
+# instead of polling the BOINC hosts itself.
+
+from boinccluster import create_app
+
+app = create_app()
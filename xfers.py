@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# xfers.py - Rates, ETAs and stalls of the file transfers of the cluster
+#
+#    Copyright (C) 2020 Jonathan Drake (drakej) <952345+drakej@users.noreply.github.com>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. See <http://www.gnu.org/licenses/gpl.html>
+
+# The core client only reports the speed of a transfer averaged since it
+# started. Each time the transfers of a host are polled, the bytes moved by
+# each active transfer since its previous poll give its current rate, and
+# from it the time left. An active transfer whose bytes haven't moved for
+# STALL_TIMEOUT seconds is stalled. Transfers seen for the first time, or
+# that started over, fall back to the speed reported by the client.
+
+import time
+
+# Seconds without progress after which an active transfer is stalled
+STALL_TIMEOUT = 300
+
+
+class TransferMonitor(object):
+    ''' Measures the client.FileTransfers of each host, remembering the bytes
+        each one had moved when last polled
+    '''
+
+    def __init__(self, stall_timeout=STALL_TIMEOUT):
+        self.stall_timeout = stall_timeout
+        # (time, bytes moved, time they last changed) of each active
+        # transfer, by (project URL, name), by host
+        self.samples = {}
+
+    def measure(self, host, transfers, now=None):
+        ''' Set the rate (bytes per second), eta (seconds left, None if
+            unknown) and stalled attributes of the transfers of host, and
+            return its summary: the upload and download rates, and the
+            number of transfers, active ones and stalled ones
+        '''
+        now = time.time() if now is None else now
+        previous = self.samples.get(host, {})
+        # transfers that are gone, or no longer active, are forgotten
+        samples = self.samples[host] = {}
+        summary = summarize(())
+
+        for transfer in transfers:
+            transfer.rate = 0.0
+            transfer.eta = None
+            transfer.stalled = False
+            summary['transfers'] += 1
+            if not transfer.xfer_active:
+                continue
+
+            key = (transfer.project_url, transfer.name)
+            sample = previous.get(key)
+            moved = transfer.bytes_xferred
+
+            if sample is None or moved < sample[1] or now <= sample[0]:
+                transfer.rate = transfer.xfer_speed
+                sample = (now, moved, now)
+            else:
+                transfer.rate = (moved - sample[1]) / (now - sample[0])
+                sample = (now, moved, now if moved > sample[1] else sample[2])
+                transfer.stalled = now - sample[2] >= self.stall_timeout
+            samples[key] = sample
+
+            if transfer.rate > 0:
+                transfer.eta = max(transfer.nbytes - moved, 0) / transfer.rate
+
+            summary['active'] += 1
+            summary['stalled'] += transfer.stalled
+            summary['upload' if transfer.is_upload else 'download'] += \
+                transfer.rate
+
+        return summary
+
+
+def summarize(summaries):
+    ''' Return the sum of the TransferMonitor.measure() summaries '''
+    total = {'upload': 0.0, 'download': 0.0, 'transfers': 0, 'active': 0,
+             'stalled': 0}
+    for summary in summaries:
+        for field in total:
+            total[field] += summary[field]
+    return total